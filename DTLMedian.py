@@ -27,12 +27,45 @@
 #       {'N':('C1','C2') ...}
 #
 
+import heapq
+import multiprocessing
 import optparse
+import os
+import random
+from collections import defaultdict
 from operator import itemgetter
 import numpy as np
 import DTLReconGraph
 import Diameter
 
+# Numba is optional. When it is installed, the median DP of large graphs is compiled to machine code.
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Whether to check that every median (and randomly chosen median) is really a subgraph of the graph it came from. These
+# checks scan the whole graph, so they are off unless the DTL_VERIFY environment variable is set to 1.
+VERIFY_MEDIAN = os.environ.get('DTL_VERIFY') == '1'
+
+# The number of events a mapping node must have before calculate_scores_for_children hands its arithmetic off to numpy.
+# Below this, the overhead of building an array outweighs the savings.
+VECTORIZE_FAN_OUT = 32
+
+# The number of mapping nodes that mapping_node_sort must be given before it sorts them with numpy
+LEXSORT_MIN_MAPPING_NODES = 64
+
+# The number of mapping nodes a graph must have before compute_median uses the compiled median DP (if numba is
+# installed). Smaller graphs are not worth the cost of converting them to arrays.
+JIT_MIN_MAPPING_NODES = 1000
+
+# The number of mapping nodes a graph must have before compute_median will split it between several processes (when
+# asked to). Below this, starting the processes takes longer than the DP itself.
+PARALLEL_MIN_MAPPING_NODES = 20000
+
+# The integer codes used for each event type when a graph is converted to arrays
+EVENT_KINDS = {'C': 0, 'L': 1, 'S': 2, 'D': 3, 'T': 4}
+
 
 def mapping_node_sort(ordered_gene_node_list, ordered_species_node_list, mapping_node_list):
     """
@@ -63,67 +96,110 @@ def mapping_node_sort(ordered_gene_node_list, ordered_species_node_list, mapping
     for i2, species_node in enumerate(ordered_species_node_list):
         species_level_lookup[species_node] = i2
 
-    # The lambda function looks up the level of both the gene node and the species nodes and adds them together to
-    # get a number to give to the sorting algorithm for that mapping node. The gene node is weighted far more heavily
-    # than the species node to make sure it is always more significant.
-    sorted_list = sorted(mapping_node_list, key=lambda node: gene_level_lookup[node[0]] + species_level_lookup[node[1]])
+    # Small lists are cheapest to sort directly.
+    if len(mapping_node_list) < LEXSORT_MIN_MAPPING_NODES:
+
+        # The lambda function looks up the level of both the gene node and the species nodes and adds them together to
+        # get a number to give to the sorting algorithm for that mapping node. The gene node is weighted far more
+        # heavily than the species node to make sure it is always more significant.
+        return sorted(mapping_node_list, key=lambda node: gene_level_lookup[node[0]] + species_level_lookup[node[1]])
+
+    # Larger lists are sorted by numpy instead, which sorts by gene level first and species level second without ever
+    # calling back into Python.
+    mapping_node_list = list(mapping_node_list)
+    gene_levels = np.fromiter((gene_level_lookup[node[0]] for node in mapping_node_list), dtype=np.int64,
+                              count=len(mapping_node_list))
+    species_levels = np.fromiter((species_level_lookup[node[1]] for node in mapping_node_list), dtype=np.int64,
+                                 count=len(mapping_node_list))
 
-    return sorted_list
+    return [mapping_node_list[i] for i in np.lexsort((species_levels, gene_levels))]
 
 
-def generate_scores(preorder_mapping_node_list, dtl_recon_graph, gene_root):
+def generate_scores(postorder_mapping_node_list, dtl_recon_graph, gene_root):
     """
     Computes frequencies for every event
-    :param preorder_mapping_node_list: A list of all mapping nodes in DTLReconGraph in double preorder
+    :param postorder_mapping_node_list: A list of all mapping nodes in DTLReconGraph in double postorder, as returned
+    by mapping_node_sort (which is the same list that compute_median takes)
     :param dtl_recon_graph: The DTL reconciliation graph that we are scoring
     :param gene_root: The root of the gene tree
-    :return: 0. A file structured like the DTLReconGraph, but with the lists of events replaced
-                with dicts, where the keys are the events and the values are the scores of those events, and
+    :return: 0. The frequency score of every event, as an EventScores object (which can be indexed by event like a
+                dictionary, or by event id through its scores array), and
              1. The number of MPRs in DTLReconGraph.
     """
 
-    # Initialize the dictionary that will store mapping node and event counts (which also acts as a memoization
-    # dictionary)
-    counts = dict()
-
-    # Initialize the very start count, for the first call of countMPRs
-    count = 0
+    # Initialize the dictionary that will store mapping node and event counts. Loss and contemporary events point at
+    # (None, None), which always has exactly one way to be reconciled.
+    counts = {(None, None): 1}
+
+    # Every distinct event is given an id, in the order that they are first seen
+    event_ids = dict()
+    events = list()
+
+    # In postorder, every child is counted before its parents, so we can fill in the counts in a single flat pass rather
+    # than recursing down from each root
+    graph_get = dtl_recon_graph.__getitem__
+    for mapping_node in postorder_mapping_node_list:
+        total = 0
+        for event_node in graph_get(mapping_node):
+            if event_node not in event_ids:
+                event_ids[event_node] = len(events)
+                events.append(event_node)
+            event_count = counts[event_node[1]] * counts[event_node[2]]
+            counts[event_node] = event_count
+            total += event_count
+        counts[mapping_node] = total
+
+    # The roots of the graph are all of the mapping nodes of the gene root, and the total number of MPRs is the sum of
+    # their counts
+    roots = [mapping_node for mapping_node in postorder_mapping_node_list if mapping_node[0] == gene_root]
+    count = sum(counts[root] for root in roots)
+
+    # Initialize the scores dict. This dict contains the frequency score of each mapping node, where the roots start
+    # with their own counts and every other mapping node will be built up by its parents. Because it defaults to 0,
+    # calculate_scores_for_children can add scores to (None, None) (which are thrown away) without a special entry.
+    scores = defaultdict(float)
+    for root in roots:
+        scores[root] = counts[root]
+
+    # event_scores takes event nodes as keys and (after being filled below) has the number of MPRs each event is in as
+    # the values. These are turned into frequencies once they are all known.
+    event_scores = {}
 
-    # Loop over all given minimum cost reconciliation roots
-    for mapping_node in preorder_mapping_node_list:
-        if mapping_node[0] == gene_root:
+    # This fills up the event scores dictionary, with parents always being scored before their children. Iterating
+    # over the postorder backwards gives us a preorder without copying the list.
+    for mapping_node in reversed(postorder_mapping_node_list):
+        calculate_scores_for_children(mapping_node, dtl_recon_graph, event_scores, scores, counts)
 
-            # This will also populate the counts dictionary with the number of MPRs each event and mapping node is in
-            count += count_mprs(mapping_node, dtl_recon_graph, counts)
+    # Normalize all of the event scores, storing them in an array indexed by event id
+    normalized_scores = np.fromiter((event_scores[event] for event in events), dtype=np.float64, count=len(events))
+    normalized_scores /= float(count)
 
-    # Initialize the scores dict. This dict contains the frequency score of each mapping node
-    scores = dict()
-    for mapping_node in preorder_mapping_node_list:
-        scores[mapping_node] = 0.0
+    return EventScores(normalized_scores, event_ids), count
 
-    # This entry is going to be thrown away, but it seems neater to just let calculateScoresOfChildren
-    # add scores to an unused entry than to check to see if they are (None, None) in the first place.
-    scores[(None, None)] = 0.0
 
-    # The scored graph is like the DTLReconGraph, except instead of individual events being in a list, they are the
-    # keys of a dictionary where the values are the frequency scores of those events. So, event_scores takes event
-    # nodes as keys and (after being filled below) has the frequencies of those events in MPRs as the values
-    event_scores = {}
+class EventScores(object):
+    """
+    The frequency scores of the events in a DTL reconciliation graph, as returned by generate_scores. The scores are
+    kept in a numpy array, where the score of each event is at the index given by event_ids, so they can be used
+    directly by array code. For everything else, an EventScores can be indexed by event just like a dictionary.
+    """
 
-    for mapping_node in preorder_mapping_node_list:
+    def __init__(self, scores, event_ids):
+        """
+        :param scores: A numpy array of the score of each event, indexed by event id
+        :param event_ids: A dictionary with event nodes as keys and their ids as values
+        """
+        self.scores = scores
+        self.event_ids = event_ids
 
-        # If we are at the root of the gene tree, then we need to initialize the score entry
-        if mapping_node[0] == gene_root:
-            scores[mapping_node] = counts[mapping_node]
-        # This fills up the event scores dictionary
-        calculate_scores_for_children(mapping_node, dtl_recon_graph, event_scores, scores, counts)
+    def __getitem__(self, event):
+        return float(self.scores[self.event_ids[event]])
 
-    # Normalize all of the event_scores
-    for mapping_node in preorder_mapping_node_list:
-        for event in dtl_recon_graph[mapping_node]:
-                event_scores[event] = event_scores[event] / float(count)
+    def __contains__(self, event):
+        return event in self.event_ids
 
-    return event_scores, count
+    def __len__(self):
+        return len(self.event_ids)
 
 
 def count_mprs(mapping_node, dtl_recon_graph, counts):
@@ -132,11 +208,10 @@ def count_mprs(mapping_node, dtl_recon_graph, counts):
     for the parasite tree onto a node of the host tree, in the format
     (p, h), where p is the parasite node and h is the host node
     :param dtl_recon_graph: A DTL reconciliation graph (see data structure quick reference at top of file)
-    :param counts: a dictionary representing the running memo that is passed
-    down recursive calls of this function. At first it is just an empty
-    dictionary (see above function), but as it gets passed down calls, it collects
-    keys of mapping nodes or event nodes and values of MPR counts. This memo improves runtime
-    of the algorithm
+    :param counts: a dictionary representing the running memo that is shared between
+    calls of this function. At first it is just an empty dictionary, but as the graph
+    is traversed it collects keys of mapping nodes or event nodes and values of MPR
+    counts. This memo improves runtime of the algorithm
     :return: the number of MPRs spawned below the given mapping node in the graph
     """
 
@@ -148,25 +223,44 @@ def count_mprs(mapping_node, dtl_recon_graph, counts):
     if mapping_node == (None, None):
         return 1
 
-    # Initialize a variable to keep count of the number of MPRs
-    count = 0
-
-    # Loop over all event nodes corresponding to the current mapping node
-    for eventNode in dtl_recon_graph[mapping_node]:
-
-        # Save the children produced by the current event
-        mapping_child1 = eventNode[1]
-        mapping_child2 = eventNode[2]
-
-        # Add the product of the counts of both children (over all children) for this event to get the parent's count
-        counts[eventNode] = count_mprs(mapping_child1, dtl_recon_graph, counts) * count_mprs(mapping_child2,
-                                                                                             dtl_recon_graph, counts)
-        count += counts[eventNode]
-
-    # Save the result in the counts
-    counts[mapping_node] = count
-
-    return count
+    # Rather than recursing, which can exceed Python's recursion limit on large graphs, we keep an explicit stack of
+    # mapping nodes. A mapping node is only counted once all of its children have been counted, and is otherwise put
+    # back on the stack underneath them.
+    graph_get = dtl_recon_graph.__getitem__
+    counts_get = counts.get
+    stack = [mapping_node]
+    while stack:
+        current = stack[-1]
+        if current in counts:
+            stack.pop()
+            continue
+
+        # Find any children of the current mapping node that still need to be counted
+        events = graph_get(current)
+        uncounted = [child for event_node in events for child in event_node[1:]
+                     if child not in counts and child != (None, None)]
+        if uncounted:
+            stack.extend(uncounted)
+            continue
+
+        # Initialize a variable to keep count of the number of MPRs
+        count = 0
+
+        # Loop over all event nodes corresponding to the current mapping node
+        for event_node in events:
+            _, mapping_child1, mapping_child2 = event_node
+
+            # Add the product of the counts of both children for this event to get the parent's count. (None, None) is
+            # never stored in the memo, so it falls back to its count of 1.
+            event_count = counts_get(mapping_child1, 1) * counts_get(mapping_child2, 1)
+            counts[event_node] = event_count
+            count += event_count
+
+        # Save the result in the counts
+        counts[current] = count
+        stack.pop()
+
+    return counts[mapping_node]
 
 
 def calculate_scores_for_children(mapping_node, dtl_recon_graph, event_scores, mapping_scores, counts):
@@ -189,76 +283,373 @@ def calculate_scores_for_children(mapping_node, dtl_recon_graph, event_scores, m
     # this mapping node's scores (scores[mapping_node]) that it gives to each event node.
     multiplier = float(mapping_scores[mapping_node]) / counts[mapping_node]
 
+    events = dtl_recon_graph[mapping_node]
+
+    # Most mapping nodes only have a handful of events, where a plain loop is fastest. For mapping nodes with a large
+    # fan-out, we let numpy do all of the multiplications at once instead.
+    if len(events) >= VECTORIZE_FAN_OUT:
+        event_counts = np.array([counts[event_node] for event_node in events], dtype=np.float64)
+        scored_events = zip(events, (multiplier * event_counts).tolist())
+    else:
+        scored_events = [(event_node, multiplier * counts[event_node]) for event_node in events]
+
     # Iterate over every event
-    for event_node in dtl_recon_graph[mapping_node]:
+    for event_node, event_score in scored_events:
 
-        event_scores[event_node] = multiplier * counts[event_node]
+        event_scores[event_node] = event_score
 
-        # Save the children produced by the current event
-        mapping_child1 = event_node[1]
-        mapping_child2 = event_node[2]
-        mapping_scores[mapping_child1] += event_scores[event_node]
-        mapping_scores[mapping_child2] += event_scores[event_node]
+        # Add the score of this event to the children it produces
+        mapping_scores[event_node[1]] += event_score
+        mapping_scores[event_node[2]] += event_score
 
 
-def compute_median(dtl_recon_graph, event_scores, postorder_mapping_nodes, mpr_roots):
+def _to_soa(dtl_recon_graph, event_scores, postorder_mapping_nodes):
     """
-    :param dtl_recon_graph: A dictionary representing a DTL Recon Graph.
-    :param event_scores: A dictionary with event nodes as keys and values corresponding to the frequency of
-    that events in MPR space for the recon graph
-    :param postorder_mapping_nodes: A list of the mapping nodes in a possible MPR, except sorted first in
-    postorder by species node and postorder by gene node
-    :param mpr_roots: A list of mapping nodes that could act as roots to an MPR for the species and
-    gene trees in question, output from the findBestRoots function in DTLReconGraph.py
-    :return: A new dictionary which is has the same form as a DTL reconciliation graph except every
-    mapping node only has one event node, along with the number of median reconciliations for the given DTL
-    reconciliation graph, as well as the root of the median MPR for the given graph. Thus, this graph will
-    represent a single reconciliation: the median reconciliation.
+    Converts a DTL reconciliation graph into flat, parallel arrays (one entry per event, instead of one tuple per
+    event), so that it can be traversed by compiled code without chasing pointers. The events of mapping node i are
+    events offsets[i] through offsets[i + 1] - 1, and each mapping node is referred to by its index in
+    postorder_mapping_nodes (or -1 for (None, None)).
+    :param dtl_recon_graph: A DTL reconciliation graph (see data structure quick reference at top of file)
+    :param event_scores: The frequency of every event, as an EventScores object returned by generate_scores
+    :param postorder_mapping_nodes: The mapping nodes of the graph, in postorder
+    :return: 0. The offsets of each mapping node's events,
+             1. The type of each event (see EVENT_KINDS),
+             2. The index of the first child mapping node of each event,
+             3. The index of the second child mapping node of each event,
+             4. The score of each event, and
+             5. A list of the event nodes themselves, so that results can be translated back into events
     """
 
-    # Note that for a symmetric median reconciliation, each frequency must have 0.5 subtracted from it
+    mapping_node_index = {(None, None): -1}
+    for i, mapping_node in enumerate(postorder_mapping_nodes):
+        mapping_node_index[mapping_node] = i
 
-    # Initialize a dict that will store the running total frequency sum incurred up to the given mapping node,
-    # and the event node that directly gave it that frequency sum. Keys are mapping nodes, values are tuples
-    # consisting of a list of event nodes that maximize the frequency - 0.5 sum score for the lower level,
-    # and the corresponding running total frequency - 0.5 sum up to that mapping node
+    events = [event for mapping_node in postorder_mapping_nodes for event in dtl_recon_graph[mapping_node]]
+
+    offsets = np.zeros(len(postorder_mapping_nodes) + 1, dtype=np.int32)
+    offsets[1:] = np.cumsum([len(dtl_recon_graph[mapping_node]) for mapping_node in postorder_mapping_nodes])
+    kinds = np.fromiter((EVENT_KINDS[event[0]] for event in events), dtype=np.uint8, count=len(events))
+    child1 = np.fromiter((mapping_node_index[event[1]] for event in events), dtype=np.int32, count=len(events))
+    child2 = np.fromiter((mapping_node_index[event[2]] for event in events), dtype=np.int32, count=len(events))
+    scores = event_scores.scores[np.fromiter((event_scores.event_ids[event] for event in events), dtype=np.int64,
+                                             count=len(events))]
+
+    return offsets, kinds, child1, child2, scores, events
+
+
+def _median_dp(offsets, kinds, child1, child2, scores):
+    """
+    The array version of the median DP in compute_median, which is compiled by numba when it is available.
+    :param offsets: The offsets of each mapping node's events (see _to_soa)
+    :param kinds: The type of each event
+    :param child1: The index of the first child mapping node of each event
+    :param child2: The index of the second child mapping node of each event
+    :param scores: The score of each event
+    :return: 0. The best running (frequency - 0.5) sum of each mapping node, and
+             1. Whether each event is one of the events that achieves its mapping node's best sum
+    """
+
+    mapping_node_count = offsets.shape[0] - 1
+    best_sums = np.zeros(mapping_node_count, dtype=np.float64)
+    event_sums = np.zeros(scores.shape[0], dtype=np.float64)
+    is_best = np.zeros(scores.shape[0], dtype=np.bool_)
+
+    for i in range(mapping_node_count):
+        start = offsets[i]
+        end = offsets[i + 1]
+
+        # Contemporaneous events have frequency 1, so 1 - 0.5 = 0.5
+        if end - start == 1 and kinds[start] == 0:
+            best_sums[i] = 0.5
+            is_best[start] = True
+            continue
+
+        best_sum = -np.inf
+        for e in range(start, end):
+            if kinds[e] == 1:
+                event_sums[e] = best_sums[child1[e]] + scores[e] - 0.5
+            else:
+                event_sums[e] = best_sums[child1[e]] + best_sums[child2[e]] + scores[e] - 0.5
+            if event_sums[e] > best_sum:
+                best_sum = event_sums[e]
+
+        best_sums[i] = best_sum
+        for e in range(start, end):
+            is_best[e] = event_sums[e] == best_sum
+
+    return best_sums, is_best
+
+
+if njit is not None:
+    _median_dp = njit(cache=True)(_median_dp)
+
+
+def _jit_sum_freqs(dtl_recon_graph, event_scores, postorder_mapping_nodes):
+    """
+    Runs the compiled median DP over a DTL reconciliation graph.
+    :param dtl_recon_graph: A DTL reconciliation graph (see data structure quick reference at top of file)
+    :param event_scores: The frequency of every event, as an EventScores object returned by generate_scores
+    :param postorder_mapping_nodes: The mapping nodes of the graph, in postorder
+    :return: The sum_freqs dictionary built by compute_median, keyed by mapping node, where each value is a tuple of the
+    best events for that mapping node and their running (frequency - 0.5) sum
+    """
+
+    offsets, kinds, child1, child2, scores, events = _to_soa(dtl_recon_graph, event_scores, postorder_mapping_nodes)
+    best_sums, is_best = _median_dp(offsets, kinds, child1, child2, scores)
+
+    # Translate the arrays back into mapping nodes and events. Only the best events are visited, and since event ids
+    # are grouped by mapping node, each one belongs to the last mapping node whose offset is not past it.
+    best_event_ids = np.flatnonzero(is_best)
+    owners = np.searchsorted(offsets, best_event_ids, side='right') - 1
     sum_freqs = dict()
+    best_events_by_node = list()
+    for map_node, best_sum in zip(postorder_mapping_nodes, best_sums.tolist()):
+        best_events = list()
+        best_events_by_node.append(best_events)
+        sum_freqs[map_node] = (best_events, best_sum)
+    for e, owner in zip(best_event_ids.tolist(), owners.tolist()):
+        best_events_by_node[owner].append(events[e])
+    return sum_freqs
+
+
+def _dict_sum_freqs(dtl_recon_graph, event_scores, postorder_mapping_nodes, sum_freqs):
+    """
+    Runs the median DP in plain Python over the given mapping nodes.
+    :param dtl_recon_graph: A DTL reconciliation graph (see data structure quick reference at top of file)
+    :param event_scores: The frequency of every event, as an EventScores object returned by generate_scores
+    :param postorder_mapping_nodes: The mapping nodes to run the DP over, in postorder
+    :param sum_freqs: The sum_freqs dictionary to fill in (see compute_median). It must already contain every child of
+    the given mapping nodes that is not among them.
+    :return: sum_freqs, filled in for every given mapping node
+    """
+
+    graph_get = dtl_recon_graph.__getitem__
+    sum_freqs_get = sum_freqs.__getitem__
+    # Rather than going through EventScores.__getitem__, we look the scores up by event id ourselves
+    score_list = event_scores.scores.tolist()
+    event_ids_get = event_scores.event_ids.__getitem__
 
     # Loop over all mapping nodes for the gene tree
     for map_node in postorder_mapping_nodes:
 
-        # Contemporaneous events need to be caught from the get-go
-        if dtl_recon_graph[map_node] == [('C', (None, None), (None, None))]:
-            sum_freqs[map_node] = ([('C', (None, None), (None, None))], 0.5)  # C events have freq 1, so 1 - 0.5 = 0.5
-            continue  # Contemporaneous events should be a lone event in a list, so we move to the next mapping node
+        events = graph_get(map_node)
+
+        # Contemporaneous events need to be caught from the get-go. They are always a lone event in a list, so
+        # checking the type of the only event is enough (and much cheaper than comparing the whole list).
+        if len(events) == 1 and events[0][0] == 'C':
+            # C events have freq 1, so 1 - 0.5 = 0.5
+            sum_freqs[map_node] = ([events[0]], 0.5)
+            continue  # Move to the next mapping node
 
-        # Get the events for the current mapping node and their running (frequency - 0.5) sums, in a list
-        events = list()
-        for event in dtl_recon_graph[map_node]:
+        # Find the best running (frequency - 0.5) sum of any event of the current mapping node, and every event
+        # that achieves it, in a single pass over the events
+        best_sum = float('-inf')
+        best_events = list()
+        for event in events:
 
             # Note that 'event' is of the form: ('event ID', 'Child 1', 'Child 2'), so the 0th element is the event
             # ID and the 1st and 2nd elements are the children produced by the event
+            event_score = score_list[event_ids_get(event)]
             if event[0] == 'L':  # Losses produce only one child, so we only need to look to one lower mapping node
-                events.append((event, sum_freqs[event[1]][1] + event_scores[event] - 0.5))
+                event_sum = sum_freqs_get(event[1])[1] + event_score - 0.5
             else:  # Only other options are T, S, and D, which produce two children
-                events.append((event, sum_freqs[event[1]][1] + sum_freqs[event[2]][1] + event_scores[event] - 0.5))
+                event_sum = sum_freqs_get(event[1])[1] + sum_freqs_get(event[2])[1] + event_score - 0.5
 
-        # Find and save the max (frequency - 0.5) sum
-        max_sum = max(events, key=itemgetter(1))[1]
+            if event_sum > best_sum:
+                best_sum = event_sum
+                best_events = [event]
+            elif event_sum == best_sum:
+                best_events.append(event)
+
+        # Save the result for this mapping node so it can be used in higher mapping nodes in the graph
+        sum_freqs[map_node] = (best_events, best_sum)
+
+    return sum_freqs
+
+
+def _sum_freqs(dtl_recon_graph, event_scores, postorder_mapping_nodes):
+    """
+    Runs the median DP over the given mapping nodes, handing large graphs off to the compiled version of the DP if
+    numba is installed.
+    :param dtl_recon_graph: A DTL reconciliation graph (see data structure quick reference at top of file)
+    :param event_scores: The frequency of every event, as an EventScores object returned by generate_scores
+    :param postorder_mapping_nodes: The mapping nodes to run the DP over, in postorder. Every child of these mapping
+    nodes must also be among them.
+    :return: The sum_freqs dictionary for the given mapping nodes (see compute_median)
+    """
+    if njit is not None and len(postorder_mapping_nodes) >= JIT_MIN_MAPPING_NODES:
+        return _jit_sum_freqs(dtl_recon_graph, event_scores, postorder_mapping_nodes)
+    return _dict_sum_freqs(dtl_recon_graph, event_scores, postorder_mapping_nodes, dict())
 
-        # Initialize list to find all events that gives the current mapping node the best (freq - 0.5) sum
-        best_events = list()
 
-        # Check to see which event(s) produce the max (frequency - 0.5) sum
+def _split_subtrees(dtl_recon_graph, postorder_mapping_nodes, gene_root, processes):
+    """
+    Splits the gene tree into independent subtrees using the ParSubtrees heuristic. The median DP of a mapping node
+    only depends on mapping nodes of the same gene node or its descendants, so the mapping nodes of separate gene
+    subtrees can be computed at the same time. Starting from the whole tree, the heaviest subtree (by number of events)
+    is repeatedly replaced by its children, and the split that should take the least time to compute is used.
+    :param dtl_recon_graph: A DTL reconciliation graph (see data structure quick reference at top of file)
+    :param postorder_mapping_nodes: The mapping nodes of the graph, in postorder
+    :param gene_root: The root of the gene tree
+    :param processes: The number of processes that the subtrees will be shared between
+    :return: 0. A list of the postorder mapping nodes of each subtree, heaviest first, and
+             1. The postorder mapping nodes that are in none of the subtrees, which must be computed after all of them
+    """
+
+    # Find the children of every gene node, and the number of events of each gene node's mapping nodes
+    gene_children = dict()
+    gene_weights = dict()
+    for mapping_node in postorder_mapping_nodes:
+        gene_node = mapping_node[0]
+        children = gene_children.setdefault(gene_node, set())
+        events = dtl_recon_graph[mapping_node]
+        gene_weights[gene_node] = gene_weights.get(gene_node, 0) + len(events)
         for event in events:
-            if event[1] == max_sum:
-                best_events.append(event[0])
+            if event[0] in ('S', 'D', 'T'):
+                children.add(event[1][0])
+                children.add(event[2][0])
+
+    # Find the weight of each gene subtree. Gene nodes are visited in the order their mapping nodes first appear in
+    # the postorder, so every child has its subtree weight before its parent does.
+    subtree_weights = dict()
+    for mapping_node in postorder_mapping_nodes:
+        gene_node = mapping_node[0]
+        if gene_node not in subtree_weights:
+            subtree_weights[gene_node] = gene_weights[gene_node] + sum(subtree_weights[child] for child in
+                                                                       gene_children[gene_node])
+
+    # Repeatedly split the heaviest subtree, estimating the time each split would take to compute as the time taken by
+    # the mapping nodes above the subtrees (which must be computed one at a time) plus the time taken by the subtrees
+    # (which is at least the weight of the heaviest, and at least an even share of all of them). The best split found
+    # is used. Note that heapq is a min heap, so the weights are negated.
+    heap = [(-subtree_weights[gene_root], gene_root)]
+    split_genes = list()
+    tail_weight = 0
+    subtrees_weight = subtree_weights[gene_root]
+    best_makespan = subtrees_weight
+    best_split_count = 0
+    while gene_children[heap[0][1]]:
+        _, gene_node = heapq.heappop(heap)
+        split_genes.append(gene_node)
+        tail_weight += gene_weights[gene_node]
+        subtrees_weight -= gene_weights[gene_node]
+        for child in gene_children[gene_node]:
+            heapq.heappush(heap, (-subtree_weights[child], child))
+
+        makespan = tail_weight + max(-heap[0][0], subtrees_weight / float(processes))
+        if makespan < best_makespan:
+            best_makespan = makespan
+            best_split_count = len(split_genes)
+
+    tail_genes = set(split_genes[:best_split_count])
+    if tail_genes:
+        subtree_roots = [child for gene_node in tail_genes for child in gene_children[gene_node]
+                         if child not in tail_genes]
+    else:
+        subtree_roots = [gene_root]
+    subtree_roots.sort(key=lambda gene_node: subtree_weights[gene_node], reverse=True)
+
+    # Find which subtree each gene node is in
+    gene_subtree = dict()
+    for i, subtree_root in enumerate(subtree_roots):
+        stack = [subtree_root]
+        while stack:
+            gene_node = stack.pop()
+            gene_subtree[gene_node] = i
+            stack.extend(gene_children[gene_node])
+
+    subtrees = [list() for _ in subtree_roots]
+    tail = list()
+    for mapping_node in postorder_mapping_nodes:
+        if mapping_node[0] in tail_genes:
+            tail.append(mapping_node)
+        else:
+            subtrees[gene_subtree[mapping_node[0]]].append(mapping_node)
+    return subtrees, tail
 
-        # Help out the garage collector by discarding the now-useless non-optimal events list
-        del events
 
-        # Save the result for this mapping node so it can be used in higher mapping nodes in the graph
-        sum_freqs[map_node] = (best_events[:], max_sum)
+# The graph, event scores, and subtrees being computed by _parallel_sum_freqs. They are set before the pool of worker
+# processes is made, so that the workers inherit them rather than having them pickled and sent for every subtree.
+_subtree_state = None
+
+
+def _subtree_sum_freqs(i):
+    """
+    Runs the median DP over one of the subtrees found by _split_subtrees, in a worker process of _parallel_sum_freqs.
+    :param i: The index of the subtree
+    :return: The sum_freqs dictionary for the mapping nodes of that subtree
+    """
+    dtl_recon_graph, event_scores, subtrees = _subtree_state
+    return _sum_freqs(dtl_recon_graph, event_scores, subtrees[i])
+
+
+def _parallel_sum_freqs(dtl_recon_graph, event_scores, postorder_mapping_nodes, gene_root, processes):
+    """
+    Runs the median DP over a graph, computing independent gene subtrees in a pool of worker processes and then
+    finishing the mapping nodes above them in this process.
+    :param dtl_recon_graph: A DTL reconciliation graph (see data structure quick reference at top of file)
+    :param event_scores: The frequency of every event, as an EventScores object returned by generate_scores
+    :param postorder_mapping_nodes: The mapping nodes of the graph, in postorder
+    :param gene_root: The root of the gene tree
+    :param processes: The number of worker processes to use
+    :return: The sum_freqs dictionary for the whole graph (see compute_median)
+    """
+    global _subtree_state
+
+    # The workers only see _subtree_state because they are forked from this process. Where there is no fork (as on
+    # Windows), Python 2 starts them afresh, so we compute the graph here instead.
+    if not hasattr(os, 'fork'):
+        return _sum_freqs(dtl_recon_graph, event_scores, postorder_mapping_nodes)
+
+    subtrees, tail = _split_subtrees(dtl_recon_graph, postorder_mapping_nodes, gene_root, processes)
+
+    # With only one subtree there is nothing to do at the same time, so a pool would only add the cost of starting it
+    if len(subtrees) <= 1:
+        return _sum_freqs(dtl_recon_graph, event_scores, postorder_mapping_nodes)
+
+    sum_freqs = dict()
+    _subtree_state = (dtl_recon_graph, event_scores, subtrees)
+    pool = multiprocessing.Pool(min(processes, len(subtrees)))
+    try:
+        # The subtrees are heaviest first, so the longest jobs are started first
+        for subtree_sum_freqs in pool.imap_unordered(_subtree_sum_freqs, range(len(subtrees))):
+            sum_freqs.update(subtree_sum_freqs)
+    finally:
+        pool.terminate()
+        pool.join()
+        _subtree_state = None
+
+    return _dict_sum_freqs(dtl_recon_graph, event_scores, tail, sum_freqs)
+
+
+def compute_median(dtl_recon_graph, event_scores, postorder_mapping_nodes, mpr_roots, processes=1):
+    """
+    :param dtl_recon_graph: A dictionary representing a DTL Recon Graph.
+    :param event_scores: An EventScores object, as returned by generate_scores, with the frequency of every
+    event in MPR space for the recon graph
+    :param postorder_mapping_nodes: A list of the mapping nodes in a possible MPR, except sorted first in
+    postorder by species node and postorder by gene node
+    :param mpr_roots: A list of mapping nodes that could act as roots to an MPR for the species and
+    gene trees in question, output from the findBestRoots function in DTLReconGraph.py
+    :param processes: The number of processes to compute large graphs with. Independent gene subtrees are computed at
+    the same time, which is only worth it for graphs with at least PARALLEL_MIN_MAPPING_NODES mapping nodes.
+    :return: A new dictionary which is has the same form as a DTL reconciliation graph except every
+    mapping node only has one event node, along with the number of median reconciliations for the given DTL
+    reconciliation graph, as well as the root of the median MPR for the given graph. Thus, this graph will
+    represent a single reconciliation: the median reconciliation.
+    """
+
+    # Note that for a symmetric median reconciliation, each frequency must have 0.5 subtracted from it
+
+    # Initialize a dict that will store the running total frequency sum incurred up to the given mapping node,
+    # and the event node that directly gave it that frequency sum. Keys are mapping nodes, values are tuples
+    # consisting of a list of event nodes that maximize the frequency - 0.5 sum score for the lower level,
+    # and the corresponding running total frequency - 0.5 sum up to that mapping node.
+    if processes > 1 and len(postorder_mapping_nodes) >= PARALLEL_MIN_MAPPING_NODES:
+        sum_freqs = _parallel_sum_freqs(dtl_recon_graph, event_scores, postorder_mapping_nodes, mpr_roots[0][0],
+                                        processes)
+    else:
+        sum_freqs = _sum_freqs(dtl_recon_graph, event_scores, postorder_mapping_nodes)
 
     # Get all possible roots of the graph and their running frequency scores, in a list, for later use
     possible_root_combos = [(root, sum_freqs[root][1]) for root in mpr_roots]
@@ -266,11 +657,8 @@ def compute_median(dtl_recon_graph, event_scores, postorder_mapping_nodes, mpr_r
     # Find the best frequency - 0.5 sum for all of the potential roots for the median
     best_sum = max(possible_root_combos, key=itemgetter(1))[1]
 
-    # Find all of the root combos for a median by filtering out the roots that don't give the best freq - 0.5 sum
-    best_root_combos = list(filter(lambda x: x[1] == best_sum, possible_root_combos))
-
-    # Extract just the roots from the previously filtered out list
-    best_roots = [root[0] for root in best_root_combos]
+    # Find all of the roots for a median by filtering out the roots that don't give the best freq - 0.5 sum
+    best_roots = [root for root, root_sum in possible_root_combos if root_sum == best_sum]
 
     # Adjust the sum_freqs dictionary so we can use it with the buildDTLReconGraph function from DTLReconGraph.py
     for map_node in sum_freqs:
@@ -285,7 +673,8 @@ def compute_median(dtl_recon_graph, event_scores, postorder_mapping_nodes, mpr_r
     med_recon_graph = DTLReconGraph.build_dtl_recon_graph(best_roots, sum_freqs, {})
 
     # Check to make sure the median is a subgraph of the DTL reconciliation
-    assert check_subgraph(dtl_recon_graph, med_recon_graph), 'Median is not a subgraph of the recon graph!'
+    if VERIFY_MEDIAN:
+        assert check_subgraph(dtl_recon_graph, med_recon_graph), 'Median is not a subgraph of the recon graph!'
 
     # We can use this function to find the number of medians once we've got the final median recon graph
     n_med_recons = DTLReconGraph.count_mprs_wrapper(best_roots, med_recon_graph)
@@ -316,67 +705,100 @@ def check_subgraph(recon_graph, subrecon):
     return True
 
 
-def choose_random_median_wrapper(median_recon, med_roots, count_dict):
+def choose_random_median_wrapper(median_recon, med_roots, count_dict, rng=None):
     """
     :param median_recon: the median reconciliation
     :param med_roots: the roots (root mapping nodes) for possible median reconciliations
     :param count_dict: a dictionary detailing how many medians can stem from an individual event
     node
+    :param rng: the random.Random instance to draw from (or None to make a new one). Passing in the same instance
+    every time avoids reseeding, and passing in a seeded one makes the chosen medians reproducible
     :return: a randomly, uniformly sampled median reconciliation graph
     """
 
+    if rng is None:
+        rng = random.Random()
+
     # Find the total amount of medians that can stem from the roots
-    total_meds = 0.0
-    for median_root in med_roots:
-        total_meds += count_dict[median_root]
+    total_meds = sum(count_dict[median_root] for median_root in med_roots)
 
-    # Create the choice list for the roots we can choose from, weighted to account for median
-    # counts each root can produce
-    # Note that numpy is so basic that we need to do a convoluted workaround to choose tuples from a list
-    final_root = med_roots[np.random.choice(len(med_roots), p=[count_dict[med_root] / total_meds for med_root in
-                                                               med_roots])]
+    # Choose the root, weighted to account for median counts each root can produce
+    final_root = _weighted_choice(rng, med_roots, count_dict, total_meds)
 
-    return choose_random_median(median_recon, final_root, count_dict)
+    random_submedian = choose_random_median(median_recon, final_root, count_dict, rng)
 
+    # Make sure our single path median is indeed a subgraph of the median
+    if VERIFY_MEDIAN:
+        assert check_subgraph(median_recon, random_submedian), 'The randomly chosen single-path median is not a ' \
+                                                               'subgraph of the full median!'
 
-def choose_random_median(median_recon, map_node, count_dict):
+    return random_submedian
+
+
+def _weighted_choice(rng, options, count_dict, total):
+    """
+    Chooses one of the options at random, where each option is chosen with probability count_dict[option] / total.
+    The counts are (possibly very large) integers, so the choice is made with exact integer arithmetic rather than
+    with floating point probabilities.
+    :param rng: the random.Random instance to draw from
+    :param options: a list of the mapping nodes or event nodes to choose from
+    :param count_dict: a dictionary that tells us how many medians each option can spawn
+    :param total: the sum of the counts of every option
+    :return: the chosen option
+    :raises ValueError: if the counts of the options add up to less than total
+    """
+
+    target = rng.randrange(total)
+    for option in options:
+        target -= count_dict[option]
+        if target < 0:
+            return option
+    raise ValueError('The counts of the options add up to less than the total!')
+
+
+def choose_random_median(median_recon, map_node, count_dict, rng=None):
     """
     :param median_recon: the full median reconciliation graph, as returned by compute_median
     :param map_node: the current mapping node in the median reconciliation that we're trying
     to find a path from. In the first call, this mapping node will be one of the root mapping
     nodes for the median reconciliation graph, randomly selected
     :param count_dict: a dictionary that tells us how many total medians a given event node can spawn
+    :param rng: the random.Random instance to draw from (or None to make a new one)
     :return: a single-path reconciliation graph that is a sub-graph of the median. It is chosen
     randomly but randomly in such a way that event node choice will favor event nodes that lead
     to more MPRs so that the data aren't skewed
     """
 
+    if rng is None:
+        rng = random.Random()
+
     # Initialize the dictionary that will store the final single-path median that we choose
     random_submedian = dict()
 
-    # Find the total number of medians we can get from the current mapping node
-    total_meds = float(count_dict[map_node])
-
-    # Use a convoluted numpy workaround to select tuples (events) from a list, taking into account
-    # how many medians each event can produce
-    next_event = median_recon[map_node][np.random.choice(len(median_recon[map_node]),
-                                                         p=[count_dict[event] / total_meds for event in
-                                                            median_recon[map_node]])]
-
-    random_submedian.update({map_node: [next_event]})
+    # Rather than recursing on the children of each chosen event, we keep an explicit stack of the mapping nodes we
+    # still need to choose an event for
+    stack = [map_node]
+    while stack:
+        map_node = stack.pop()
+        events = median_recon[map_node]
+
+        # Select an event, taking into account how many medians each event can produce. Most mapping nodes only have
+        # one event, so there is nothing to choose.
+        if len(events) == 1:
+            next_event = events[0]
+        else:
+            next_event = _weighted_choice(rng, events, count_dict, count_dict[map_node])
 
-    # Check for a loss
-    if next_event[0] == 'L':
-        random_submedian.update(choose_random_median(median_recon, next_event[1], count_dict))
+        random_submedian[map_node] = [next_event]
 
-    # Check for events that produce two children
-    elif next_event[0] in ['T', 'S', 'D']:
-        random_submedian.update(choose_random_median(median_recon, next_event[1], count_dict))
-        random_submedian.update(choose_random_median(median_recon, next_event[2], count_dict))
+        # Check for a loss
+        if next_event[0] == 'L':
+            stack.append(next_event[1])
 
-    # Make sure our single path median is indeed a subgraph of the median
-    assert check_subgraph(median_recon, random_submedian), 'The randomly chosen single-path median is not a subgraph ' \
-                                                           'of the full median!'
+        # Check for events that produce two children
+        elif next_event[0] in ['T', 'S', 'D']:
+            stack.append(next_event[2])
+            stack.append(next_event[1])
 
     return random_submedian
 
@@ -386,7 +808,7 @@ def usage():
     :return: the usage statement associated with running this file
     """
 
-    return 'usage: DTLMedian filename dup_cost transfer_cost loss_cost [-r] [-n]'
+    return 'usage: DTLMedian filename dup_cost transfer_cost loss_cost [-r] [-n] [-s seed] [-p processes]'
 
 
 def main():
@@ -401,6 +823,11 @@ def main():
                  action='store_true', default=False)
     p.add_option('-c', '--count', dest='count', help='Add the number of median reconciliations to'
                                                      'the output', action='store_true', default=False)
+    p.add_option('-s', '--seed', dest='seed', help='Seed the random number generator used to choose the random median,'
+                                                   ' so that the same median is chosen every time', type='int',
+                 default=None)
+    p.add_option('-p', '--processes', dest='processes', help='The number of processes to find the median of large'
+                                                             ' graphs with', type='int', default=1)
 
     options, args = p.parse_args()
 
@@ -425,16 +852,17 @@ def main():
             postorder_species_tree, species_tree_root, species_node_count = Diameter.reformat_tree(species_tree,
                                                                                                    "hTop")
 
-            # Get a list of the mapping nodes in preorder
+            # Get a list of the mapping nodes in postorder
             postorder_mapping_node_list = mapping_node_sort(postorder_gene_tree, postorder_species_tree,
                                                             dtl_recon_graph.keys())
 
             # Find the dictionary for frequency scores for the given mapping nodes and graph, and the given gene root
-            scores_dict = generate_scores(postorder_mapping_node_list[::-1], dtl_recon_graph, gene_tree_root)
+            scores_dict = generate_scores(postorder_mapping_node_list, dtl_recon_graph, gene_tree_root)
 
             # Now find the median and related info
             median_reconciliation, n_meds, roots_for_median = compute_median(dtl_recon_graph, scores_dict[0],
-                                                                             postorder_mapping_node_list, best_roots)
+                                                                             postorder_mapping_node_list, best_roots,
+                                                                             options.processes)
 
             # We'll always want to output the median
             output.append(median_reconciliation)
@@ -454,7 +882,8 @@ def main():
                     count_mprs(root, median_reconciliation, med_counts)
 
                 # In case we may want it, calculate a random, uniformly sampled single-path median from the median recon
-                random_median = choose_random_median_wrapper(median_reconciliation, roots_for_median, med_counts)
+                random_median = choose_random_median_wrapper(median_reconciliation, roots_for_median, med_counts,
+                                                             random.Random(options.seed))
                 output.append(random_median)
 
             # Now print all of the output requested by the user
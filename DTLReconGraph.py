@@ -34,6 +34,10 @@ import newickFormatReader
 
 Infinity = float('inf')
 
+# Every contemporaneous event is the same event node, so we only ever make this one. Each mapping node with a
+# contemporaneous event has it as its only event.
+C_EVENT = ("C", (None, None), (None, None))
+
 
 def preorder(tree, root_edge_name):
     """
@@ -160,7 +164,7 @@ def DP(host_tree, parasite_tree, phi, dup_cost, transfer_cost, loss_cost):
                     A[(ep, eh)] = 0
 
                     # Create a contemporary event
-                    A_min = [("C", (None, None), (None, None))]
+                    A_min = [C_EVENT]
                 else:
                     # Non-matched tips can't reconcile
 
@@ -444,16 +448,21 @@ def count_mprs(mapping_node, dtl_recon_graph, memo):
 
     # Initialize a variable to keep count of the number of MPRs
     count = 0
+    memo_get = memo.get
 
-    # Loop over all event nodes corresponding to the current mapping node
-    for eventNode in dtl_recon_graph[mapping_node]:
+    # Loop over all event nodes corresponding to the current mapping node, saving the children each one produces
+    for _, mapping_child1, mapping_child2 in dtl_recon_graph[mapping_node]:
 
-        # Save the children produced by the current event
-        mapping_child1 = eventNode[1]
-        mapping_child2 = eventNode[2]
+        # Children that have already been counted are looked up directly, rather than with another call
+        child1_count = memo_get(mapping_child1)
+        if child1_count is None:
+            child1_count = count_mprs(mapping_child1, dtl_recon_graph, memo)
+        child2_count = memo_get(mapping_child2)
+        if child2_count is None:
+            child2_count = count_mprs(mapping_child2, dtl_recon_graph, memo)
 
         # Add the product of the counts of both children (over all children) for this event to get the parent's count
-        count += count_mprs(mapping_child1, dtl_recon_graph, memo) * count_mprs(mapping_child2, dtl_recon_graph, memo)
+        count += child1_count * child2_count
 
     # Save the result in the memo
     memo[mapping_node] = count
@@ -491,21 +500,48 @@ def build_dtl_recon_graph(best_roots, event_dict, unique_dict):
     :param event_dict: a dictionary representing events and the corresponding children
     for each node - see eventDict in DP for more info on the format of this input
     :param unique_dict: a dictionary of unique vertex mappings, which initially
-    starts empty and gets built up using eventDict and tupleList using recursion
-    :return: the modified uniqueDict for this particular call of the function which,
-    after all recursive calls are done, will be the final DTL reconciliation graph
+    starts empty and gets built up using eventDict, following the events of each
+    mapping node down to its children
+    :return: the modified uniqueDict, which will be the final DTL reconciliation graph
     """
 
-    for vertexPair in best_roots:
+    # We keep an explicit stack of the mapping nodes left to visit, rather than recursing, so that deep graphs can't
+    # exceed Python's recursion limit
+    stack = list(best_roots)
+    while stack:
+        vertexPair = stack.pop()
         if vertexPair not in unique_dict:
             unique_dict[vertexPair] = event_dict[vertexPair]
             for event in event_dict[vertexPair]:
                 for location in event:
                     if type(location) is tuple and location != (None, None):
-                        build_dtl_recon_graph([location], event_dict, unique_dict)
+                        stack.append(location)
     return unique_dict
 
 
+def intern_mapping_nodes(dtl_recon_graph, best_roots):
+    """
+    The DP builds a new tuple every time it refers to a mapping node, so the same mapping node is usually held by many
+    identical tuples. This replaces all of them with the single tuple used as the mapping node's key, which saves
+    memory and lets dictionary lookups succeed on the faster identity check.
+    :param dtl_recon_graph: a DTL reconciliation graph, as returned by build_dtl_recon_graph
+    :param best_roots: the roots of the DTL reconciliation graph
+    :return: the DTL reconciliation graph and the best roots, using one tuple for each mapping node
+    """
+
+    canonical_nodes = {(None, None): (None, None)}
+    for mapping_node in dtl_recon_graph:
+        canonical_nodes[mapping_node] = mapping_node
+    canonical = canonical_nodes.setdefault
+
+    interned_graph = dict()
+    for mapping_node, events in dtl_recon_graph.iteritems():
+        interned_graph[mapping_node] = [event if event[0] == 'C' else
+                                        (event[0], canonical(event[1], event[1]), canonical(event[2], event[2]))
+                                        for event in events]
+    return interned_graph, [canonical(root, root) for root in best_roots]
+
+
 def reconcile(file_name, dup_cost, transfer_cost, loss_cost):
     """
     :param file_name: the file in which the desired data set it stored, passed as
@@ -522,6 +558,7 @@ def reconcile(file_name, dup_cost, transfer_cost, loss_cost):
     # Note: I have made modifications to the return statement to make Diameter.py possible without re-reconciling.
     host, paras, phi = newickFormatReader.getInput(file_name)
     graph, best_cost, num_recon, best_roots = DP(host, paras, phi, dup_cost, transfer_cost, loss_cost)
+    graph, best_roots = intern_mapping_nodes(graph, best_roots)
     return host, paras, graph, num_recon, best_roots
 
 
@@ -6,60 +6,291 @@
 
 import csv
 import numpy
+import matplotlib
 import matplotlib.pyplot as plt
 import os
 import optparse
 
+# Pandas is optional. When it is installed, log files are parsed by its C parser rather than row by row in Python.
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+# Numba is optional too. When it is installed (along with pandas), the rows to ignore are picked out by compiled code,
+# which follows exactly the same rule as keep_row.
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Bottleneck is optional as well. When it is installed, medians are found with its selection algorithm, which is faster
+# than numpy's.
+try:
+    from bottleneck import median as find_median
+except ImportError:
+    find_median = numpy.median
+
+# The most points we will draw in any one scatter plot. Drawing (and zooming) a scatter plot gets very slow with more
+# points than this, so larger logs are plotted with a random sample of their points.
+MAX_PLOT_POINTS = 50000
+
+# The number of rows of a log that read_columns has pandas read at a time
+CHUNK_ROWS = 100000
+
 def displayListValues(list, name):
     print name + ": "
     if not isinstance(list[0],(int, float)):
         print "(Not Number)"
     else:
-        print "\tMin:\t{0}".format(min(list))
-        print "\tMax:\t{0}".format(max(list))
-        print "\tMedian:\t{0}".format(numpy.median(list))
-        print "\tMean:\t{0}".format(numpy.mean(list))
+        # The lists are usually float64 arrays already, in which case this doesn't copy anything
+        values = numpy.asarray(list, dtype=numpy.float64)
+        print "\tMin:\t{0}".format(values.min())
+        print "\tMax:\t{0}".format(values.max())
+        # Bottleneck may give us back a Python float, which would print differently
+        print "\tMedian:\t{0}".format(numpy.float64(find_median(values)))
+        print "\tMean:\t{0}".format(values.mean())
         print ""
 
+def ignored_mprs(mpr_strip):
+    """Finds the MPR counts of the rows that an mpr_strip ignores.
+    :param mpr_strip:   Rows with fewer MPRs than this are ignored
+    :return:            A set of those MPR counts, written as they are in a log"""
+    return set(map(str, range(0, mpr_strip)))
+
+
+def keep_row(mpr_count, median_count, ignore_mprs, mpr_equals_median_strip):
+    """Decides whether a row of a log is kept. This is the one rule that every way of reading a log follows: counts are
+    compared exactly as they are written in the log, so an MPR count of "1.0" is not ignored by an mpr_strip of 2, and
+    "4" is not equal to "4.0".
+    :param mpr_count:               The row's MPR count, as written in the log
+    :param median_count:            The row's median count, as written in the log (or None if the log has none)
+    :param ignore_mprs:             The MPR counts of the rows to ignore, from ignored_mprs
+    :param mpr_equals_median_strip: Whether to ignore rows where every MPR is a median
+    :return:                        True if the row is kept"""
+    return mpr_count not in ignore_mprs and not (mpr_equals_median_strip and mpr_count == median_count)
+
+
 def read_file(csv_file, mpr_strip=0, mpr_equals_median_strip=False):
 
-    properties = {}
-    column = {}
-    ignore_mprs = []
-    if mpr_strip > 0:
-        ignore_mprs = map(str, range(0, mpr_strip))
+    ignore_mprs = ignored_mprs(mpr_strip)
+
+    if pandas is not None:
+        return read_file_pandas(csv_file, mpr_strip, ignore_mprs, mpr_equals_median_strip)
 
     with open(csv_file) as file:
         reader = csv.reader(file)
         header = reader.next()
 
-        MPR_count_column = 0
-        median_count_column = 0
+        MPR_count_column = None
+        median_count_column = None
 
         # Get the index of each property to allow us to search that row.
         for i, element in enumerate(header):
-            properties[element] = []
-            column[i] = element
             if element == "MPR Count":
                 MPR_count_column = i
             elif element == "Median Count":
                 median_count_column = i
 
+        # Each column's values are collected in a list we find by index, which is cheaper than looking the column's
+        # name up in a dict for every cell.
+        col_lists = [[] for _ in header]
+        # Binding each list's append method ahead of time saves looking it up for every cell
+        appends = [values.append for values in col_lists]
+        mpr_col = MPR_count_column
+        med_col = median_count_column
+
         for row in reader:
 
-            if row[MPR_count_column] not in ignore_mprs and (not mpr_equals_median_strip or row[MPR_count_column] !=
-                                                             row[median_count_column]):
+            if mpr_col is None or keep_row(row[mpr_col], None if med_col is None else row[med_col], ignore_mprs,
+                                           mpr_equals_median_strip):
                 for i, property in enumerate(row):
-                    properties[column[i]] += [property]
+                    appends[i](property)
+
+    properties = {element: col_lists[i] for i, element in enumerate(header)}
+    length = len(col_lists[0])
+    name_to_row = {element: i for i, element in enumerate(header)}
+    return properties, length, name_to_row
+
+
+def _keep_mask(mpr, med, mpr_strip, mpr_equals_median_strip):
+    """Does the same thing as keep_row for every row at once, but works on the bytes of the counts so that it can be
+    compiled by numba.
+    :param mpr:                     The MPR count of every row, as a 2D uint8 array holding one count's bytes (padded
+                                     with zeros) in each row
+    :param med:                     The median count of every row, in the same form and width as mpr
+    :param mpr_strip:               Rows with fewer MPRs than this are ignored
+    :param mpr_equals_median_strip: Whether to ignore rows where every MPR is a median
+    :return:                        A boolean array that is True for each row to keep"""
+    rows, width = mpr.shape
+    keep = numpy.empty(rows, numpy.bool_)
+    for i in range(rows):
+        # The counts in ignored_mprs(mpr_strip) are exactly the ones written as digits with no leading zero (other than
+        # "0" itself) whose value is less than mpr_strip.
+        ignored = mpr_strip > 0 and width > 0 and mpr[i, 0] != 0
+        value = 0
+        for j in range(width):
+            c = mpr[i, j]
+            if c == 0:
+                break
+            if c < 48 or c > 57 or (j > 0 and value == 0):
+                ignored = False
+                break
+            value = value * 10 + (c - 48)
+            if value >= mpr_strip:
+                ignored = False
+                break
+        keep[i] = not ignored
+        if keep[i] and mpr_equals_median_strip:
+            same = True
+            for j in range(width):
+                if mpr[i, j] != med[i, j]:
+                    same = False
+                    break
+            keep[i] = not same
+    return keep
+
+
+if njit is not None:
+    _keep_mask = njit(nogil=True, cache=True)(_keep_mask)
+
+
+def _count_bytes(counts, width):
+    """Turns a column of counts into the form _keep_mask takes.
+    :param counts:  The counts, as an array of strings
+    :param width:   The length of the longest count we will compare them against
+    :return:        A 2D uint8 array holding the bytes of one count in each row"""
+    return counts.astype("S{0}".format(width)).view(numpy.uint8).reshape(len(counts), width)
+
+
+def filter_rows(data, mpr_strip, ignore_mprs, mpr_equals_median_strip):
+    """Removes the rows that keep_row doesn't keep from a log (or a chunk of one) that pandas has read.
+    :param data:                    The log, as a pandas DataFrame of strings
+    :param mpr_strip:               Rows with fewer MPRs than this are ignored
+    :param ignore_mprs:             The MPR counts of the rows to ignore, from ignored_mprs
+    :param mpr_equals_median_strip: Whether to ignore rows where every MPR is a median
+    :return:                        The rows of data that we keep"""
+    if "MPR Count" not in data.columns:
+        return data
+    mpr_equals_median_strip = mpr_equals_median_strip and "Median Count" in data.columns
+    if njit is not None:
+        # The compiled mask compares the same bytes that keep_row compares, so it always picks the same rows
+        mpr = data["MPR Count"].values.astype(str)
+        width = mpr.itemsize
+        if mpr_equals_median_strip:
+            med = data["Median Count"].values.astype(str)
+            width = max(width, med.itemsize)
+            med = _count_bytes(med, width)
+        mpr = _count_bytes(mpr, width)
+        if not mpr_equals_median_strip:
+            med = mpr
+        keep = _keep_mask(mpr, med, mpr_strip, mpr_equals_median_strip)
+    else:
+        keep = ~data["MPR Count"].isin(ignore_mprs)
+        if mpr_equals_median_strip:
+            keep &= data["MPR Count"] != data["Median Count"]
+    return data.loc[keep]
+
 
-    length = len(properties[column[0]])
-    name_to_row = {v: k for k, v in column.iteritems()}
+def read_file_pandas(csv_file, mpr_strip, ignore_mprs, mpr_equals_median_strip):
+    """Does the same thing as read_file, but has pandas parse the file and filter out the rows we want to ignore all at
+    once, rather than one row at a time."""
+
+    # Every cell is kept as the string it was in the file (including empty ones), just like csv.reader would give us
+    data = pandas.read_csv(csv_file, dtype=str, keep_default_na=False, engine="c")
+    data = filter_rows(data, mpr_strip, ignore_mprs, mpr_equals_median_strip)
+
+    properties = {name: data[name].tolist() for name in data.columns}
+    length = len(data)
+    name_to_row = {name: i for i, name in enumerate(data.columns)}
     return properties, length, name_to_row
 
+
+def read_columns(csv_file, columns, numeric_columns, mpr_strip=0, mpr_equals_median_strip=False,
+                 chunksize=CHUNK_ROWS):
+    """Reads some of the columns of a log, ignoring the same rows that read_file does. Unlike read_file, only the cells
+    of the columns we want are kept, and the numeric columns are turned into arrays, so this needs much less memory for
+    logs with many columns.
+    :param csv_file:                The log file to read
+    :param columns:                 The names of the columns we want. Any that aren't in the log are left out.
+    :param numeric_columns:         The names of the columns to return as float64 arrays. The other columns are
+                                     returned as lists of strings.
+    :param mpr_strip:               Rows with fewer MPRs than this are ignored
+    :param mpr_equals_median_strip: Whether to ignore rows where every MPR is a median
+    :param chunksize:               The number of rows pandas reads at a time (if it is installed)
+    :return:                        A dict from the name of each column we read to its values, and the number of rows
+                                     we kept"""
+    with open(csv_file) as file:
+        header = csv.reader(file).next()
+
+    wanted = [name for name in header if name in columns]
+    ignore_mprs = ignored_mprs(mpr_strip)
+
+    if pandas is not None:
+        return read_columns_pandas(csv_file, header, wanted, numeric_columns, mpr_strip, ignore_mprs,
+                                   mpr_equals_median_strip, chunksize)
+
+    indices = [header.index(name) for name in wanted]
+    col_lists = [[] for _ in wanted]
+    mpr_col = header.index("MPR Count") if "MPR Count" in header else None
+    med_col = header.index("Median Count") if "Median Count" in header else None
+    # Pair each column's index with its list's append method once, rather than for every row
+    pickers = zip([values.append for values in col_lists], indices)
+
+    with open(csv_file) as file:
+        reader = csv.reader(file)
+        reader.next()
+        for row in reader:
+            if mpr_col is not None and not keep_row(row[mpr_col], None if med_col is None else row[med_col],
+                                                    ignore_mprs, mpr_equals_median_strip):
+                continue
+            for append, i in pickers:
+                append(row[i])
+
+    properties = {}
+    for name, values in zip(wanted, col_lists):
+        if name in numeric_columns:
+            properties[name] = numpy.asarray(values, dtype=numpy.float64)
+        else:
+            properties[name] = values
+    length = len(col_lists[0]) if col_lists else 0
+    return properties, length
+
+
+def read_columns_pandas(csv_file, header, wanted, numeric_columns, mpr_strip, ignore_mprs, mpr_equals_median_strip,
+                        chunksize):
+    """Does the same thing as read_columns, but has pandas parse the log chunksize rows at a time. The numeric columns
+    are turned into arrays as we go, so that we never hold every cell of a large log in memory at once."""
+    # We also need the columns that decide which rows to ignore, even if we weren't asked for them
+    usecols = [name for name in header if name in wanted or name in ("MPR Count", "Median Count")]
+
+    chunks = {name: [] for name in wanted}
+    length = 0
+    for data in pandas.read_csv(csv_file, dtype=str, keep_default_na=False, engine="c", usecols=usecols,
+                                chunksize=chunksize):
+        data = filter_rows(data, mpr_strip, ignore_mprs, mpr_equals_median_strip)
+        length += len(data)
+        for name in wanted:
+            if name in numeric_columns:
+                chunks[name].append(data[name].values.astype(numpy.float64))
+            else:
+                chunks[name].extend(data[name].tolist())
+
+    properties = {}
+    for name in wanted:
+        if name in numeric_columns:
+            properties[name] = numpy.concatenate(chunks[name] or [numpy.empty(0)])
+        else:
+            properties[name] = chunks[name]
+    return properties, length
+
 def set_xlabel(axis, label, letter, latex):
-    if latex:
+    if latex and plt.rcParams['text.usetex']:
         axis.set_xlabel(label+"\n"r"{\fontsize{7pt}{1em}\selectfont{}("+letter+r")}",
                         linespacing=3, labelpad=3)
+    elif latex:
+        # LaTeX isn't installed, so matplotlib draws the label itself, and can't make the letter smaller
+        axis.set_xlabel(label + "\n(" + letter + ")", linespacing=3, labelpad=3)
     else:
         axis.set_xlabel(label)
 
@@ -67,9 +298,60 @@ def set_xlabel(axis, label, letter, latex):
 def set_ylabel(axis, label, latex):
     axis.set_ylabel(label)
 
+def sample_points(count, max_points):
+    """Chooses which points of a scatter plot to draw, so that plots of very large logs stay responsive. The same
+    points are chosen every time.
+    :param count:       The number of points in the scatter plot
+    :param max_points:  The most points we may draw (or None to draw every point)
+    :return:            Something to index the data arrays with: either a sorted array of the indices of the points to
+                         draw, or a slice of every point if there are few enough."""
+    if not max_points or count <= max_points:
+        return slice(None)
+    return numpy.sort(numpy.random.RandomState(0).choice(count, max_points, replace=False))
+
+
+def draw_points(axis, x, y, color, size):
+    """Draws a scatter plot where every point has the same color and size. This uses plot rather than scatter, which
+    stamps the same marker at every point instead of working out a color and size for each one, and is much faster.
+    :param axis:        The axis to draw on
+    :param x:           The x coordinates of the points
+    :param y:           The y coordinates of the points
+    :param color:       The color of every point
+    :param size:        The area of every point, in points^2 (just like scatter's s)"""
+    axis.plot(x, y, linestyle='', marker='o', markersize=size ** 0.5, markeredgewidth=0, color=color, rasterized=True)
+
+
+def draw_histogram(axis, values, bins, color, linewidth, **kwargs):
+    """Draws a horizontal histogram. We count the values into bins with numpy ourselves, and then have matplotlib draw
+    one weighted value per bin, so that it never has to copy and bin every value itself.
+    :param axis:        The axis to draw on
+    :param values:      The values to count
+    :param bins:        The number of bins, or an array of the edges of every bin (just like hist's bins)
+    :param color:       The color of the bars
+    :param linewidth:   The width of the bars' edges
+    :param kwargs:      Anything else to pass on to hist"""
+    counts, edges = numpy.histogram(numpy.asarray(values, dtype=numpy.float64), bins)
+    axis.hist(edges[:-1], bins=edges, weights=counts, orientation='horizontal', color=color, linewidth=linewidth,
+              **kwargs)
+
+
+def set_window_title(fig, title):
+    """Sets the title of the window a figure is shown in. Newer versions of matplotlib only let us do this through the
+    figure's manager, but older ones don't always give every figure one.
+    :param fig:     The figure whose window we are titling
+    :param title:   The title"""
+    try:
+        fig.canvas.manager.set_window_title(title)
+    except AttributeError:
+        fig.canvas.set_window_title(title)
+
+
 def make_plot(file, y_limits, non_normalized, timings, gene_count_list, diameter_list, diameter_name,
               normalized_diameter, normalized_diameter_name, mpr_list, DP_timings,
-              diameter_timings, total_timings, name, latex, color):
+              diameter_timings, total_timings, name, latex, color, max_points=MAX_PLOT_POINTS):
+    # The histograms use every point, but the scatter plots only draw these ones
+    shown = sample_points(len(gene_count_list), max_points)
+
     size = 0.6
     linewidth = 0
     histcolor = '0.15'
@@ -105,16 +387,22 @@ def make_plot(file, y_limits, non_normalized, timings, gene_count_list, diameter
             fig.subplots_adjust(bottom=0.3)
             fig.set_size_inches(width, height)
 
-        fig.canvas.set_window_title("{0} Plots {1}".format(file, name))
+        set_window_title(fig, "{0} Plots {1}".format(file, name))
 
         diameter = ax[1]
         diameter_hist = ax[0]
         mpr_diameter = ax[2]
         set_ylabel(ax[0], diameter_name, latex)
 
-        diameter.scatter(gene_count_list, diameter_list, c=color, s=size, linewidth=linewidth)
-        set_xlabel(diameter, "Gene Tree Size", "b", latex)
+        # We know the limits of the scatter plots before drawing them, so we set them first. Otherwise, matplotlib
+        # works out limits from the data that we would throw away.
         diameter.set_xlim(0, gene_xlim)
+        diameter.set_ylim(y_bottom, y_top)
+        diameter.set_autoscale_on(False)
+        mpr_diameter.set_ylim(y_bottom, y_top)
+
+        draw_points(diameter, gene_count_list[shown], diameter_list[shown], color, size)
+        set_xlabel(diameter, "Gene Tree Size", "b", latex)
         if not latex:
             diameter.set_title("{0} vs. Gene Tree Size".format(diameter_name))
 
@@ -124,14 +412,14 @@ def make_plot(file, y_limits, non_normalized, timings, gene_count_list, diameter
             bins = numpy.logspace(numpy.log10(y_bottom), numpy.log10(y_top), bins)
         else:
             diameter_hist.set_ylim(y_bottom, y_top)
-        diameter_hist.hist(diameter_list, orientation='horizontal', bins=bins, color=histcolor, linewidth=linewidth)
+        draw_histogram(diameter_hist, diameter_list, bins, histcolor, linewidth)
         # diameter_hist.set_ylabel("Diameter")
         set_xlabel(diameter_hist, "Number of Gene Families", "a", latex)
         if not latex:
             diameter_hist.set_title(diameter_name)
 
 
-        mpr_diameter.scatter(mpr_list, diameter_list, c=color, s=size, linewidth=linewidth)
+        draw_points(mpr_diameter, mpr_list[shown], diameter_list[shown], color, size)
         set_xlabel(mpr_diameter, "MPR Count", "c", latex)
         if not latex:
             mpr_diameter.set_title("{0} vs. MPR Count".format(diameter_name))
@@ -149,8 +437,6 @@ def make_plot(file, y_limits, non_normalized, timings, gene_count_list, diameter
             a.tick_params(axis='both', which='major', labelsize=6)
             a.grid()
 
-        mpr_diameter.set_ylim(y_bottom, y_top)
-        diameter.set_ylim(y_bottom, y_top)
         #fig.tight_layout()
 
     fig, ax = plt.subplots(ncols=3, nrows=1)
@@ -159,29 +445,31 @@ def make_plot(file, y_limits, non_normalized, timings, gene_count_list, diameter
         fig.subplots_adjust(bottom=0.3)
         fig.set_size_inches(width, height)
 
-    fig.canvas.set_window_title("{0} Normalized Plots {1}".format(file, name))
+    set_window_title(fig, "{0} Normalized Plots {1}".format(file, name))
     norm_diameter_hist = ax[0]
     norm_mpr_diameter = ax[2]
     norm_diameter = ax[1]
     set_ylabel(ax[0], normalized_diameter_name, latex)
 
-    norm_diameter.scatter(gene_count_list, normalized_diameter, c=color, s=size, linewidth=linewidth)
-    set_xlabel(norm_diameter, "Gene Tree Size", "b", latex)
     norm_diameter.set_xlim(0, gene_xlim)
-    # norm_diameter.set_ylabel("Diameter (normalized to gene node count)")
     norm_diameter.set_ylim(diameter_ylim_b, diameter_ylim_t)
+    norm_diameter.set_autoscale_on(False)
+    norm_mpr_diameter.set_ylim(diameter_ylim_b, diameter_ylim_t)
+
+    draw_points(norm_diameter, gene_count_list[shown], normalized_diameter[shown], color, size)
+    set_xlabel(norm_diameter, "Gene Tree Size", "b", latex)
+    # norm_diameter.set_ylabel("Diameter (normalized to gene node count)")
     if not latex:
         norm_diameter.set_title("{0} vs. Gene Tree Size".format(normalized_diameter_name))
 
-    norm_diameter_hist.hist(normalized_diameter, 50, orientation='horizontal', color=histcolor, linewidth=linewidth, rwidth=1)
+    draw_histogram(norm_diameter_hist, normalized_diameter, 50, histcolor, linewidth, rwidth=1)
     # norm_diameter_hist.set_ylabel("Diameter (normalized to gene node count)")
     set_xlabel(norm_diameter_hist, "Number of Gene Families", "a", latex)
     if not latex:
         norm_diameter_hist.set_title("{0} Counts".format(normalized_diameter_name))
     norm_diameter_hist.set_ylim(diameter_ylim_b, diameter_ylim_t)
 
-    norm_mpr_diameter.scatter(mpr_list, normalized_diameter, c=color, s=size, linewidth=linewidth)
-    norm_mpr_diameter.set_ylim(diameter_ylim_b, diameter_ylim_t)
+    draw_points(norm_mpr_diameter, mpr_list[shown], normalized_diameter[shown], color, size)
     set_xlabel(norm_mpr_diameter, "MPR Count", "c", latex)
     if not latex:
         norm_mpr_diameter.set_title("{0} vs. MPR Count".format(normalized_diameter_name))
@@ -208,26 +496,26 @@ def make_plot(file, y_limits, non_normalized, timings, gene_count_list, diameter
             fig.subplots_adjust(bottom=0.3)
             fig.set_size_inches(width, height)
 
-        fig.canvas.set_window_title("{0} Running Times {1}".format(file, name))
+        set_window_title(fig, "{0} Running Times {1}".format(file, name))
         DP_time = ax[0]
         diameter_time = ax[1]
         total_time = ax[2]
-        DP_time.scatter(gene_count_list, DP_timings, c=color, s=size, linewidth=linewidth)
+        draw_points(DP_time, gene_count_list[shown], DP_timings[shown], color, size)
         set_xlabel(DP_time, "Gene Tree Size", "a", latex)
         set_ylabel(DP_time, "Time (seconds)", latex)
         if not latex:
             DP_time.set_title("Computing Reconciliation Graph")
         DP_time.set_yscale('log')
         DP_time.set_xscale('log')
-        diameter_time.scatter(gene_count_list, diameter_timings, c=color, s=size, linewidth=linewidth)
+        diameter_time.set_ylim(0.01,10**2)
+        draw_points(diameter_time, gene_count_list[shown], diameter_timings[shown], color, size)
         set_xlabel(diameter_time, "Gene Tree Size", "b", latex)
         #diameter_time.set_ylabel("Time (seconds)")
         if not latex:
             diameter_time.set_title("Computing {0}".format(diameter_name))
         diameter_time.set_yscale('log')
-        diameter_time.set_ylim(0.01,10**2)
         diameter_time.set_xscale('log')
-        total_time.scatter(gene_count_list, total_timings, c=color, s=size, linewidth=linewidth)
+        draw_points(total_time, gene_count_list[shown], total_timings[shown], color, size)
         set_xlabel(total_time, "Gene Tree Size", "c", latex)
         #total_time.set_ylabel("Time (seconds)")
         if not latex:
@@ -246,7 +534,8 @@ def make_plot(file, y_limits, non_normalized, timings, gene_count_list, diameter
 
 
 
-def analyse_data(csv_file, given_properties, non_normalized, timings, plot, latex, strip_mprs, strip_equal):
+def analyse_data(csv_file, given_properties, non_normalized, timings, plot, latex, strip_mprs, strip_equal,
+                 max_points=MAX_PLOT_POINTS):
     """
     This function analyses a provided csv_file of data returned from RunTests.py. The analysis will include a list of
      the mins, maxes, medians, and modes of several specified properties, and might also include plots.
@@ -265,28 +554,44 @@ def analyse_data(csv_file, given_properties, non_normalized, timings, plot, late
                              in our analysis
     :param strip_equal:     A boolean value representing whether we want to include families in which every
                              reconciliation is a median
+    :param max_points:      The most points to draw in any scatter plot (or None to draw every point). Larger logs are
+                             plotted with a random sample of their points.
     """
 
-    if plot:
-        plt.rc('text', usetex=latex)
-        if latex:
-            #plt.rc('font', **{'family': 'serif', 'serif': ['Computer Modern'], 'size': '22'})
-            plt.rc('font', **{'family': 'sans-serif', 'size': '8'})
-            plt.rcParams['text.latex.preamble'] = [
-                r"\usepackage{amsmath}",
-                r'\usepackage{siunitx}',  # i need upright \micro symbols, but you need...
-                r'\sisetup{detect-all}',  # ...this to force siunitx to actually use your fonts
-                r'\usepackage{helvet}',  # set the normal font here
-                r'\usepackage{sansmath}',  # load up the sansmath so that math -> helvet
-                r'\sansmath'  # <- tricky! -- gotta actually tell tex to use!
-            ]
+    # Starting LaTeX is slow, so we only do it when we are going to plot something with it. If LaTeX isn't installed,
+    # we still lay the plots out for the paper, but matplotlib typesets them instead (checkdep_usetex warns about this).
+    if plot and latex:
+        plt.rc('text', usetex=matplotlib.checkdep_usetex(True))
+        #plt.rc('font', **{'family': 'serif', 'serif': ['Computer Modern'], 'size': '22'})
+        plt.rc('font', **{'family': 'sans-serif', 'size': '8'})
+        plt.rcParams['text.latex.preamble'] = [
+            r"\usepackage{amsmath}",
+            r'\usepackage{siunitx}',  # i need upright \micro symbols, but you need...
+            r'\sisetup{detect-all}',  # ...this to force siunitx to actually use your fonts
+            r'\usepackage{helvet}',  # set the normal font here
+            r'\usepackage{sansmath}',  # load up the sansmath so that math -> helvet
+            r'\sansmath'  # <- tricky! -- gotta actually tell tex to use!
+        ]
 
     mpr_list = []
 
     diameter_present = False
     zero_loss_present = False
 
-    properties_that_exist_in_file, length, _ = read_file(csv_file, strip_mprs, strip_equal)
+    required_properties = ["Costs", "MPR Count", "Gene Node Count", "DTLReconGraph Computation Time"]
+    # Only read the columns we use, and turn the numeric ones into arrays as we read them
+    wanted = set(required_properties) | {"Species Node Count"}
+    numeric = {"MPR Count", "Gene Node Count", "Species Node Count", "DTLReconGraph Computation Time"}
+    for prop in given_properties:
+        wanted.add(prop)
+        if "Diameter" in prop or "Count" in prop or "Number" in prop or "Distance" in prop:
+            numeric.add(prop)
+            if timings:
+                wanted.add(prop + " Computation Time")
+                numeric.add(prop + " Computation Time")
+        elif timings:
+            wanted.add(prop + " Computation Time")
+    properties_that_exist_in_file, length = read_columns(csv_file, wanted, numeric, strip_mprs, strip_equal)
 
 
     for prop in given_properties:
@@ -294,18 +599,21 @@ def analyse_data(csv_file, given_properties, non_normalized, timings, plot, late
         assert prop + " Computation Time" in properties_that_exist_in_file or not timings, \
             "Property '{0}' passed to analyse_data did not have associated " \
             "timing information in log file '{1}'!".format(prop, csv_file)
-    for prop in ["Costs", "MPR Count", "Gene Node Count", "DTLReconGraph Computation Time"]:
+    for prop in required_properties:
         assert prop in properties_that_exist_in_file, "Required property '{0}' was not found in log file '{1}'!".format(prop, csv_file)
 
     DTL = properties_that_exist_in_file["Costs"][0]
     mpr_list = properties_that_exist_in_file["MPR Count"]
-    mpr_list = map(lambda e: float(e), mpr_list)
+    mpr_list = numpy.asarray(mpr_list, dtype=numpy.float64)
     gene_count_list = properties_that_exist_in_file["Gene Node Count"]
-    gene_count_list= map(lambda e: float(e), gene_count_list)
-    #species_count_list = properties_that_exist_in_file["Species Node Count"]
-    #species_count_list = map(lambda e: float(e), species_count_list)
+    gene_count_list = numpy.asarray(gene_count_list, dtype=numpy.float64)
+    # Older logs don't record the size of the species tree
+    species_count_list = None
+    if "Species Node Count" in properties_that_exist_in_file:
+        species_count_list = properties_that_exist_in_file["Species Node Count"]
+        species_count_list = numpy.asarray(species_count_list, dtype=numpy.float64)
     DP_timings = properties_that_exist_in_file["DTLReconGraph Computation Time"]
-    DP_timings = map(lambda e: float(e), DP_timings)
+    DP_timings = numpy.asarray(DP_timings, dtype=numpy.float64)
     prop_list_dict = {}
     timing_list_dict = {}
 
@@ -313,24 +621,23 @@ def analyse_data(csv_file, given_properties, non_normalized, timings, plot, late
         prop_list_dict[property] = properties_that_exist_in_file[property]
         # This is kind of janky. We only turn properties with these names into floats
         if "Diameter" in property or "Count" in property or "Number" in property or "Distance" in property:
-            prop_list_dict[property] = map(lambda e: float(e), prop_list_dict[property])
+            prop_list_dict[property] = numpy.asarray(prop_list_dict[property], dtype=numpy.float64)
             if timings:
                 timing_list_dict[property + " Computation Time"] = properties_that_exist_in_file[property + " Computation Time"]
 
-    # We assign to the total timings variable even if we are not using timings, because other functions
-    # want it, even if they are unused.
-    total_timings = DP_timings[:]
+    # make_plot only uses the total timings when we are plotting timings
+    total_timings = None
     if timings:
+        total_timings = DP_timings.copy()
         for timing_list in timing_list_dict:
-            timing_list_dict[timing_list] = map(lambda e: float(e), timing_list_dict[timing_list])
-            cur_list = timing_list_dict[timing_list]
-            for i, time in enumerate(cur_list):
-                total_timings[i] += time
+            timing_list_dict[timing_list] = numpy.asarray(timing_list_dict[timing_list], dtype=numpy.float64)
+            total_timings += timing_list_dict[timing_list]
 
 
     displayListValues(mpr_list, "MPR Count")
     displayListValues(gene_count_list, "Gene Tree Size")
-    displayListValues(gene_count_list, "Species Tree Size")
+    if species_count_list is not None:
+        displayListValues(species_count_list, "Species Tree Size")
     #displayListValues(mpr_over_d_list, "MPR Count/Diameter")
     #displayListValues(mpr_over_normalized_d_list, "MPR Count/(Diameter/Gene Tree Size)")
     if timings:
@@ -354,7 +661,7 @@ def analyse_data(csv_file, given_properties, non_normalized, timings, plot, late
 
         # plot_info_list is a list of tuples with the format ("NAME", normalizing_list, "Normalized Name", (bottom_lim,
         # top_lim), data_list). data_list is the list of values we are plotting, and normalizing_list is the list of
-        # values we will normalize against.
+        # values we will normalize against (or None if we don't normalize it).
 
         # To make a property something that we try to plot if possible, add another if statement here.
 
@@ -383,7 +690,7 @@ def analyse_data(csv_file, given_properties, non_normalized, timings, plot, late
 
         if "Random Median Distance Standard Deviation" in prop_list_dict:
             data_list = prop_list_dict["Random Median Distance Standard Deviation"]
-            plot_info_list += [("Random Median Distance Standard Deviation", [1] * len(prop_list_dict["Diameter"]), "Random Median Distance Standard Deviation", (0,4), data_list)]
+            plot_info_list += [("Random Median Distance Standard Deviation", None, "Random Median Distance Standard Deviation", (0,4), data_list)]
 
         if "Unique Median Count" in prop_list_dict:
             data_list = prop_list_dict["Unique Median Count"]
@@ -407,8 +714,11 @@ def analyse_data(csv_file, given_properties, non_normalized, timings, plot, late
             normalized_prop_name = prop[2]
             y_limits = prop[3]
             prop_data = prop[4]
-            prop_normalized = map(lambda i: prop_data[i[0]] / prop_normalized_against[i[0]],
-                             enumerate(prop_data))
+            # A property that is not normalized against anything is plotted as it is
+            if prop_normalized_against is None:
+                prop_normalized = numpy.asarray(prop_data, dtype=numpy.float64)
+            else:
+                prop_normalized = prop_data / numpy.asarray(prop_normalized_against, dtype=numpy.float64)
             if timings:
                 timing_data = timing_list_dict[prop_name + " Computation Time"]
             else:
@@ -419,46 +729,38 @@ def analyse_data(csv_file, given_properties, non_normalized, timings, plot, late
 
             make_plot(csv_file, y_limits, non_normalized, timings, gene_count_list, data_list,
                       prop_name, prop_normalized, normalized_prop_name, mpr_list, DP_timings,
-                      timing_data, total_timings, prop_name + " " + name_postfix, latex, color)
+                      timing_data, total_timings, prop_name + " " + name_postfix, latex, color, max_points)
 
 
 def find_specific(csv_file="COG_Cluster_L.csv"):
     file_props, length, column_lookup = read_file(csv_file, False, False)
 
-    mprs_1 = 0
-    mprs_2 = 0
-    mprs_gt_2 = 0
-    mprs_gt_2_not = 0
-    mprs_gt_2_eq = 0
-    mpr_eq_med = 0
-    mpr_not_med = 0
-    mpr_lt = [0]*13
-    mpr_gt = 0
     mpr_diameter_neq_med_diameter = -1
-    mpr_diameter_eq_med_diameter_mpr_gt_1 = 0
-
-    for i in range(0, length):
-        mpr_count = file_props["MPR Count"][i]
-        median = file_props["Median Count"][i]
-        diameter = file_props["Diameter"][i]
-        median_diameter = file_props["Random Median Distance Average"][i]
-        if int(mpr_count) > 1:
-            if int(float(median_diameter) / float(diameter)) == 1:
-                mpr_diameter_eq_med_diameter_mpr_gt_1 += 1
-        if mpr_count == "1":
-            mprs_1 += 1
-        elif mpr_count == "2":
-            mprs_2 += 1
-        else:
-            mprs_gt_2 += 1
-            if mpr_count == median:
-                mprs_gt_2_not += 1
-            else:
-                mprs_gt_2_eq += 1
-        if mpr_count == median:
-            mpr_eq_med += 1
-        else:
-            mpr_not_med += 1
+
+    # Each of these is an array with one element per family, so that every count can be found with a single sum
+    mpr_count = numpy.asarray(file_props["MPR Count"])
+    median = numpy.asarray(file_props["Median Count"])
+    diameter = numpy.asarray(file_props["Diameter"], dtype=numpy.float64)
+    median_diameter = numpy.asarray(file_props["Random Median Distance Average"], dtype=numpy.float64)
+
+    mpr_is_1 = mpr_count == "1"
+    mpr_is_2 = mpr_count == "2"
+    mpr_gt_2 = ~(mpr_is_1 | mpr_is_2)
+    mpr_is_med = mpr_count == median
+
+    mprs_1 = int(mpr_is_1.sum())
+    mprs_2 = int(mpr_is_2.sum())
+    mprs_gt_2 = int(mpr_gt_2.sum())
+    mprs_gt_2_not = int((mpr_gt_2 & mpr_is_med).sum())
+    mprs_gt_2_eq = int((mpr_gt_2 & ~mpr_is_med).sum())
+    mpr_eq_med = int(mpr_is_med.sum())
+    mpr_not_med = length - mpr_eq_med
+
+    # MPR counts can be too large for an integer array, but floats are plenty to tell whether they are more than 1. The
+    # families with one MPR may have a diameter of 0, but we don't look at their ratio anyway.
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        ratio_is_1 = numpy.trunc(median_diameter / diameter) == 1
+    mpr_diameter_eq_med_diameter_mpr_gt_1 = int(((mpr_count.astype(numpy.float64) > 1) & ratio_is_1).sum())
 
 
     print "{0} families observed.".format(length)
@@ -477,44 +779,53 @@ def check_files(log, path):
     if path[-1] != "/":
         path = path + "/"
 
-    data_files = map(lambda x: path + x, os.listdir(path))
+    data_files = [path + x for x in os.listdir(path)]
+    data_file_set = set(data_files)
+    seen = set()
     duplicates = []
     with open(log) as file:
         reader = csv.reader(file)
+        next(reader, None)  # Skip the header (if the log has one)
         for row in reader:
-            if row[0] not in data_files:
+            if row[0] in seen or row[0] not in data_file_set:
                 duplicates += [row[0]]
-            else:
-                data_files.remove(row[0])
-        print "Duplicates ({0}):\t {1}".format(len(duplicates[1:]), duplicates[1:])
-        print "Missing ({0}):\t {1}".format(len(data_files), data_files)
+            seen.add(row[0])
+        missing = [data_file for data_file in data_files if data_file not in seen]
+        print "Duplicates ({0}):\t {1}".format(len(duplicates), duplicates)
+        print "Missing ({0}):\t {1}".format(len(missing), missing)
+
+
+def read_log_columns(log, columns):
+    """Reads some of the columns of every row of a log file (including the header row) into arrays of strings.
+    :param log:         The log file to read
+    :param columns:     A list of the indices of the columns we want
+    :return:            A list containing an array for each of the given columns"""
+    if pandas is not None:
+        data = pandas.read_csv(log, header=None, usecols=columns, dtype=str, keep_default_na=False, engine="c")
+        return [data[column].values for column in columns]
+    with open(log) as file:
+        # Only keep the cells we want from each row, rather than every row in full
+        cells = [[row[column] for column in columns] for row in csv.reader(file)]
+    return [numpy.asarray([row_cells[i] for row_cells in cells], dtype=object) for i in range(len(columns))]
 
 
 def compare_logs(log1="New_COG_01.csv", log2="New_COG_02_zl.csv"):
     """"""
-    log1_diams = []
-    log2_diams = []
-    filenames = []
-    mismatches = 0
-    difference = 0.0
-    count = 0
-    with open(log1) as file:
-        reader = csv.reader(file)
-        for row in reader:
-            filenames += [row[0]]
-            log1_diams += [row[3]]
-    with open(log2) as file:
-        reader = csv.reader(file)
-        for row in reader:
-            log2_diams += [row[3]]
-    for i in range(0, len(log1_diams)):
-        count += 1
-        if log1_diams[i] != log2_diams[i]:
-            difference += (float(log1_diams[i]) - int(log2_diams[i]))/int(log2_diams[i])
-            print "Mismatch in {0}: {1} vs. {2}".format(filenames[i], log1_diams[i], log2_diams[i])
-            mismatches += 1
-        #else:
-            #print "Match in {0}: {1} vs. {2}".format(filenames[i], log1_diams[i], log2_diams[i])
+    filenames, log1_diams = read_log_columns(log1, [0, 3])
+    log2_diams, = read_log_columns(log2, [3])
+
+    # Only the rows that are in both logs can be compared
+    count = min(len(log1_diams), len(log2_diams))
+    log1_diams = log1_diams[:count]
+    log2_diams = log2_diams[:count]
+
+    # Compare every row at once, and then only look at the ones that don't match
+    mismatched = numpy.flatnonzero(log1_diams != log2_diams)
+    mismatches = len(mismatched)
+    log2_mismatched = log2_diams[mismatched].astype(numpy.float64)
+    difference = float(((log1_diams[mismatched].astype(numpy.float64) - log2_mismatched) / log2_mismatched).sum())
+    for name, log1_diam, log2_diam in zip(filenames[mismatched], log1_diams[mismatched], log2_diams[mismatched]):
+        print "Mismatch in {0}: {1} vs. {2}".format(name, log1_diam, log2_diam)
     print "{0} mismatches, or {0}/{2} = {1}%".format(mismatches,mismatches/(float(count))*100,count)
 
 
@@ -555,11 +866,16 @@ def main():
                                                                 "directory, and report any duplicate files in the log,"
                                                                 "and any files in the directory but not in the log.",
                  metavar="CHECK_PATH")
+    p.add_option("--max-points", dest="max_points", type="int", default=MAX_PLOT_POINTS,
+                 help="draw at most this many points in each scatter plot, choosing them at random (this must be "
+                      "positive)")
 
     "Median Diameter"
     (options, args) = p.parse_args()
     if len(args) != 1:
         p.error("1 argument must be provided: file")
+    if options.max_points <= 0:
+        p.error("--max-points must be positive, not {0}".format(options.max_points))
     file = args[0]
     zero_loss = options.zero_loss
     latex = options.use_latex
@@ -600,7 +916,8 @@ def main():
     if not os.path.isfile(file):
         p.error("File not found, '{0}'. Please be sure you typed the name correctly!".format(file))
     else:
-        analyse_data(file, plot_types, non_normalized, timings, plot, latex, strip_mprs, strip_equal)
+        analyse_data(file, plot_types, non_normalized, timings, plot, latex, strip_mprs, strip_equal,
+                     options.max_points)
         if compare_file is not None:
             compare_logs(file, compare_file)
         if check is not None:
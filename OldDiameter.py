@@ -144,6 +144,7 @@ import time
 import csv
 import os.path
 from collections import OrderedDict
+from timeit import default_timer
 
 # Used for command line arguments:
 
@@ -670,7 +671,7 @@ def calculate_diameter_from_file(filename, D, T, L, log=None, debug=False, verbo
     assert isinstance(debug, bool)
 
     # Record the time that DTLReconGraph starts
-    start_time = time.clock()
+    start_time = default_timer()
 
     # Get everything we need from DTLReconGraph
     species_tree, gene_tree, dtl_recon_graph, mpr_count, _ = DTLReconGraph.reconcile(filename, D, T, L)
@@ -687,22 +688,22 @@ def calculate_diameter_from_file(filename, D, T, L, log=None, debug=False, verbo
 
 
     # And record the amount of time DTLReconGraph + cleaning up the graph took
-    DTLReconGraph_time_taken = time.clock() - start_time
+    DTLReconGraph_time_taken = default_timer() - start_time
 
     if verbose:
         print "Reconciliation Graph Made in \033[33m\033[1m{0} seconds\033[0m".format(DTLReconGraph_time_taken)
 
-    start_time = time.clock()
+    start_time = default_timer()
 
     # Now we draw the rest of the owl
     diameter = diameter_algorithm(species_tree, gene_tree, gene_tree_root, dtl_recon_graph, debug, False)
 
     # And record how long it took to compute the diameter.
-    diameter_time_taken = time.clock() - start_time
+    diameter_time_taken = default_timer() - start_time
 
-    start_time = time.clock()
+    start_time = default_timer()
     zl_diameter = diameter_algorithm(species_tree, gene_tree, gene_tree_root, dtl_recon_graph, debug, True)
-    zl_diameter_time_taken = time.clock() - start_time
+    zl_diameter_time_taken = default_timer() - start_time
 
     if verbose:
         print "The diameter of the given reconciliation graph is \033[33m\033[1m{0}\033[0m, (or \033[33m\033[1m{1}\033[0m if losses do not affect the diameter)".format(diameter, zl_diameter)
@@ -756,7 +757,7 @@ def repeatedly_calculate_diameter(file_pattern, start, end, d, t, l, log=None, d
             raise  # Don't prevent the user from exiting the program.
         except:
             if verbose:
-                print traceback.print_exc(sys.exc_traceback)
+                traceback.print_exc()
             print "Could not reconcile file '{0}'. Continuing, but please make sure the file was formatted correctly!"\
                 .format(cur_file)
 
@@ -9,7 +9,11 @@ import time
 import DTLReconGraph
 import DTLMedian
 import os
+import random
+import multiprocessing
 import numpy as np
+from contextlib import contextmanager
+from timeit import default_timer
 
 # Used for command line arguments:
 import sys
@@ -19,6 +23,15 @@ import optparse
 
 import ReconGraphFileInterchange
 
+@contextmanager
+def timed():
+    """Times the body of a with statement using the best wall clock timer available. time.clock only measures processor
+    time (and is gone in newer versions of Python), so this should be used to time everything instead.
+    :return:    A function that returns the number of seconds elapsed since the with statement was entered
+    """
+    start_time = default_timer()
+    yield lambda: default_timer() - start_time
+
 
 def write_to_csv(csv_file, costs, filename, mpr_count, gene_node_count, species_node_count,
                  DTLReconGraph_time_taken, properties):
@@ -37,36 +50,48 @@ def write_to_csv(csv_file, costs, filename, mpr_count, gene_node_count, species_
                                          2 (optional, and creates complimentary header): Time taken
     """
     file_exists = os.path.isfile(csv_file)
-    # If they only supply one argument, let's correct it for them.
-    if isinstance(properties, tuple):
-        properties = [properties]
 
     with open(csv_file, 'a') as output_file:
         writer = csv.writer(output_file)
+        write_csv_row(writer, not file_exists, costs, filename, mpr_count, gene_node_count, species_node_count,
+                      DTLReconGraph_time_taken, properties)
 
-        # Write the headers if we need to.
-        if not file_exists:
-            header = ["File Name", "Date Completed", "Costs", "MPR Count", "Gene Node Count", "Species Node Count",
-                      "DTLReconGraph Computation Time"]
-            for property in properties:
-                header += [property[0]]
-
-                # This property may associated timing data, which should be included
-                if len(property) == 3:
-                    header += ["{0} Computation Time".format(property[0])]
-            writer.writerow(header)
-        numbers = [filename, time.strftime("%c"), costs, mpr_count, gene_node_count, species_node_count,
-                   DTLReconGraph_time_taken]
+
+def write_csv_row(writer, write_header, costs, filename, mpr_count, gene_node_count, species_node_count,
+                  DTLReconGraph_time_taken, properties):
+    """Writes one row to an already open csv writer, so that many rows can be written without reopening the file. The
+    rest of the parameters are the same as for write_to_csv.
+    :param writer:                      The csv writer to write to
+    :param write_header:                Whether to write the header row before this row (because the file is new)
+    """
+    # If they only supply one argument, let's correct it for them.
+    if isinstance(properties, tuple):
+        properties = [properties]
+
+    # Write the headers if we need to.
+    if write_header:
+        header = ["File Name", "Date Completed", "Costs", "MPR Count", "Gene Node Count", "Species Node Count",
+                  "DTLReconGraph Computation Time"]
         for property in properties:
-            numbers += [property[1]]
+            header += [property[0]]
 
             # This property may associated timing data, which should be included
             if len(property) == 3:
-                numbers += [property[2]]
-        writer.writerow(numbers)
+                header += ["{0} Computation Time".format(property[0])]
+        writer.writerow(header)
+    numbers = [filename, time.strftime("%c"), costs, mpr_count, gene_node_count, species_node_count,
+               DTLReconGraph_time_taken]
+    for property in properties:
+        numbers += [property[1]]
+
+        # This property may associated timing data, which should be included
+        if len(property) == 3:
+            numbers += [property[2]]
+    writer.writerow(numbers)
 
 
-def find_median_and_count(gene_tree, gene_tree_root, species_tree, dtl_recon_graph, best_roots):
+def find_median_and_count(gene_tree, gene_tree_root, species_tree, dtl_recon_graph, best_roots,
+                          postorder_mapping_node_list=None):
     """
     Finds the entire median reconciliation graph, and counts the number of reconciliations.
     :param gene_tree:       The gene tree, in vertex format
@@ -75,19 +100,21 @@ def find_median_and_count(gene_tree, gene_tree_root, species_tree, dtl_recon_gra
     :param dtl_recon_graph: The entire DTL mpr reconciliation graph
     :param best_roots:      best_roots, a list of mapping nodes that can be the root of MPRs (as returned from
                              DTLReconGraph.reconcile)
+    :param postorder_mapping_node_list: The mapping nodes of dtl_recon_graph in postorder, as returned by
+                             DTLMedian.mapping_node_sort (or None to sort them here)
     :return:                An entry in the results list for the count AND the median reconciliation
     """
-    start_time = time.clock()
-    preorder_mapping_node_list = DTLMedian.mapping_node_sort(gene_tree, species_tree, dtl_recon_graph.keys())
+    with timed() as median_time_taken:
+        if postorder_mapping_node_list is None:
+            postorder_mapping_node_list = DTLMedian.mapping_node_sort(gene_tree, species_tree, dtl_recon_graph.keys())
 
-    # Find the dictionary for frequency scores for the given mapping nodes and graph, as well as the given gene root
-    scoresDict = DTLMedian.generate_scores(list(reversed(preorder_mapping_node_list)), dtl_recon_graph, gene_tree_root)
+        # Find the dictionary for frequency scores for the given mapping nodes and graph, as well as the given gene root
+        scoresDict = DTLMedian.generate_scores(postorder_mapping_node_list, dtl_recon_graph, gene_tree_root)
 
-    median_reconciliation, n_meds, _ = DTLMedian.compute_median(dtl_recon_graph, scoresDict[0],
-                                                                preorder_mapping_node_list,
-                                                                best_roots)
-    median_time_taken = time.clock() - start_time
-    return [("Median Count", n_meds, median_time_taken)], median_reconciliation
+        median_reconciliation, n_meds, _ = DTLMedian.compute_median(dtl_recon_graph, scoresDict[0],
+                                                                    postorder_mapping_node_list,
+                                                                    best_roots)
+    return [("Median Count", n_meds, median_time_taken())], median_reconciliation
 
 
 def find_worst_median_distance(species_tree, gene_tree, gene_tree_root, dtl_recon_graph, median_reconciliation, debug):
@@ -101,11 +128,10 @@ def find_worst_median_distance(species_tree, gene_tree, gene_tree_root, dtl_reco
     :param debug:                   Whether or not to print debug tables
     :return:                        An entry to be added to the results list containing the Worst Median Distance
     """
-    start_time = time.clock()
-    worst_median_distance = Diameter.diameter_algorithm(species_tree, gene_tree, gene_tree_root,
-                                                        median_reconciliation, dtl_recon_graph, debug, False)
-    worst_median_distance_time_taken = time.clock() - start_time
-    return [("Worst Median Distance", worst_median_distance, worst_median_distance_time_taken)]
+    with timed() as worst_median_distance_time_taken:
+        worst_median_distance = Diameter.diameter_algorithm(species_tree, gene_tree, gene_tree_root,
+                                                            median_reconciliation, dtl_recon_graph, debug, False)
+    return [("Worst Median Distance", worst_median_distance, worst_median_distance_time_taken())]
 
 
 def find_median_diameter(species_tree, gene_tree, gene_tree_root, median_reconciliation, debug):
@@ -119,15 +145,14 @@ def find_median_diameter(species_tree, gene_tree, gene_tree_root, median_reconci
     :param debug:                   Whether or not to print debug tables
     :return:                        An entry to be added to the results list containing the Worst Median Distance
     """
-    start_time = time.clock()
-    median_diameter = Diameter.diameter_algorithm(species_tree, gene_tree, gene_tree_root,
-                                                  median_reconciliation, median_reconciliation, debug, False)
-    worst_median_diameter_time_taken = time.clock() - start_time
-    return [("Median Diameter", median_diameter, worst_median_diameter_time_taken)]
+    with timed() as median_diameter_time_taken:
+        median_diameter = Diameter.diameter_algorithm(species_tree, gene_tree, gene_tree_root,
+                                                      median_reconciliation, median_reconciliation, debug, False)
+    return [("Median Diameter", median_diameter, median_diameter_time_taken())]
 
 
 def find_median_cluster(filename, log, costs, gene_tree, gene_tree_root, species_tree, dtl_recon_graph, best_roots,
-                        cluster_size):
+                        cluster_size, postorder_mapping_node_list=None):
     """
     Finds the maximum distance from a randomly selected median reconciliation a set number of times, and records
      each diameter in a special log file. The average and standard deviation of the found distances (among other things)
@@ -144,19 +169,21 @@ def find_median_cluster(filename, log, costs, gene_tree, gene_tree_root, species
     :param best_roots:          best_roots, a list of mapping nodes that can be the root of MPRs (as returned from
                                  DTLReconGraph.reconcile)
     :param cluster_size:        The number of medians we should compute per cluster
+    :param postorder_mapping_node_list: The mapping nodes of dtl_recon_graph in postorder, as returned by
+                                 DTLMedian.mapping_node_sort (or None to sort them here)
     :return:                    An entry (to be added to the results list) containing information about the cluster.
     """
-    start_time = time.clock()
+    start_time = default_timer()
 
     _, file_log_name = os.path.split(filename)
     file_log_name, _ = os.path.splitext(file_log_name)
     file_log_path = os.path.splitext(log)[0] + "/" + file_log_name + ".csv"
 
-    preorder_mapping_node_list = DTLMedian.mapping_node_sort(gene_tree, species_tree, dtl_recon_graph.keys())
-    scoresDict = DTLMedian.generate_scores(list(reversed(preorder_mapping_node_list)), dtl_recon_graph,
-                                           gene_tree_root)
+    if postorder_mapping_node_list is None:
+        postorder_mapping_node_list = DTLMedian.mapping_node_sort(gene_tree, species_tree, dtl_recon_graph.keys())
+    scoresDict = DTLMedian.generate_scores(postorder_mapping_node_list, dtl_recon_graph, gene_tree_root)
     median_recon, n_meds, med_roots = DTLMedian.compute_median(dtl_recon_graph, scoresDict[0],
-                                                               preorder_mapping_node_list,
+                                                               postorder_mapping_node_list,
                                                                best_roots)
     med_counts = dict()
     for root in med_roots:
@@ -166,45 +193,56 @@ def find_median_cluster(filename, log, costs, gene_tree, gene_tree_root, species
     old_medians = dict()
 
     random_median_diameters = []
-    # Every time this loop repeats, we calculate another random median and find its diameter
-
-    for i in range(0, cluster_size):
-        # TODO: Move inner loop to own function
-        start_sub_time = time.clock()
-
-        random_median = DTLMedian.choose_random_median_wrapper(median_recon, med_roots, med_counts)
-        median_hash = hash(str(random_median))
-
-        end_random_time = time.clock() - start_sub_time
-        start_sub_time = time.clock()
-
-        random_median_diameter = None  # Initialize this entry for the dict
-
-        if median_hash in old_medians:
-            # We've already computed the diameter for this, so we can save some time by re-using the old values
-            random_median_diameter = old_medians[median_hash]
-            end_sub_time = 0
-        else:
-            random_median_diameter = Diameter.diameter_algorithm(species_tree, gene_tree, gene_tree_root,
-                                                                 random_median, dtl_recon_graph, False, False)
-            old_medians[median_hash] = random_median_diameter
-
-            end_sub_time = time.clock() - start_sub_time
-
-        sub_results = [("Random Median", median_hash, end_random_time),
-                       ("Random Median Distance", random_median_diameter, end_sub_time)]
 
-        # Store this diameter so that we can do maths to it
-        random_median_diameters += [random_median_diameter]
+    # Every random median in the cluster is drawn from the same generator
+    rng = random.Random()
 
-        if log is not None:
-            write_to_csv(file_log_path, costs, filename, n_meds, -1, -1,
-                         -1, sub_results)
+    # Each random median gets its own row in the special log file, so we keep it open for the whole cluster
+    log_file = None
+    write_header = False
+    if log is not None:
+        write_header = not os.path.isfile(file_log_path)
+        log_file = open(file_log_path, 'a')
+        log_writer = csv.writer(log_file)
+
+    try:
+        # Every time this loop repeats, we calculate another random median and find its diameter
+        for i in range(0, cluster_size):
+            # TODO: Move inner loop to own function
+            with timed() as random_time:
+                random_median = DTLMedian.choose_random_median_wrapper(median_recon, med_roots, med_counts, rng)
+                median_hash = hash(str(random_median))
+            end_random_time = random_time()
+
+            random_median_diameter = None  # Initialize this entry for the dict
+
+            if median_hash in old_medians:
+                # We've already computed the diameter for this, so we can save some time by re-using the old values
+                random_median_diameter = old_medians[median_hash]
+                end_sub_time = 0
+            else:
+                with timed() as sub_time:
+                    random_median_diameter = Diameter.diameter_algorithm(species_tree, gene_tree, gene_tree_root,
+                                                                         random_median, dtl_recon_graph, False, False)
+                end_sub_time = sub_time()
+                old_medians[median_hash] = random_median_diameter
+
+            sub_results = [("Random Median", median_hash, end_random_time),
+                           ("Random Median Distance", random_median_diameter, end_sub_time)]
+
+            # Store this diameter so that we can do maths to it
+            random_median_diameters += [random_median_diameter]
+
+            if log_file is not None:
+                write_csv_row(log_writer, write_header and i == 0, costs, filename, n_meds, -1, -1, -1, sub_results)
+    finally:
+        if log_file is not None:
+            log_file.close()
 
     avg = np.average(random_median_diameters)
     std_dev = np.std(random_median_diameters)
 
-    random_median_diameter_time_taken = time.clock() - start_time
+    random_median_diameter_time_taken = default_timer() - start_time
     return [("Random Median Distance Average", avg, random_median_diameter_time_taken),
             ("Random Median Distance Standard Deviation", std_dev),
             ("Best Random Median Distance", min(random_median_diameters)),
@@ -214,7 +252,7 @@ def find_median_cluster(filename, log, costs, gene_tree, gene_tree_root, species
 
 def run_single_calculation(filename, D, T, L, log=None, debug=False, verbose=True, zero_loss=False, median=False,
                            worst_median=False, median_cluster=0, median_diameter=False, save_graph=False,
-                           save_median_graph=False):
+                           save_median_graph=False, write_log=True, csv_writer=None, write_header=False):
     """This function computes the diameter of space of MPRs in a DTL reconciliation problem,
      as measured by the symmetric set distance between the events of the two reconciliations of the pair
       that has the highest such difference.
@@ -235,7 +273,13 @@ def run_single_calculation(filename, D, T, L, log=None, debug=False, verbose=Tru
       :param median_diameter: Whether we should calculate the diameter of median-space.
       :param save_graph:    Whether we should save the dtl recon graph as a SIF file to be viewed (or possibly
                              reimported)
-      :return:              Nothing, but we output results to a csv file, or the screen"""
+      :param write_log:     Whether we should write our results to the log (if there is one) ourselves, rather than
+                             leaving that to the caller
+      :param csv_writer:    An already open csv writer to write our results to, rather than opening the log ourselves
+                             (or None to open the log as usual)
+      :param write_header:  Whether we should write the header row to csv_writer before our results
+      :return:              The row of results for the csv file, as a tuple of the arguments to write_to_csv that
+                             come after csv_file. We also output results to a csv file, or the screen"""
 
     # These statements check to make sure that all arguments were entered correctly.
     assert isinstance(log, (str, unicode)) or log is None
@@ -245,21 +289,18 @@ def run_single_calculation(filename, D, T, L, log=None, debug=False, verbose=Tru
     assert isinstance(L, (int, float))
     assert isinstance(debug, bool)
 
-    # Record the time that DTLReconGraph starts
-    start_time = time.clock()
-
-    # Get everything we need from DTLReconGraph
-    edge_species_tree, edge_gene_tree, dtl_recon_graph, mpr_count, best_roots = DTLReconGraph.reconcile(filename, D, T,
-                                                                                                        L)
-
-    # The gene tree needs to be in node format, not edge format, so we find that now.
-    # (This also puts the gene_tree into postorder, as an ordered dict)
-    gene_tree, gene_tree_root, gene_node_count = Diameter.reformat_tree(edge_gene_tree, "pTop")
+    # Record the amount of time DTLReconGraph + cleaning up the graph takes
+    with timed() as DTLReconGraph_time_taken:
+        # Get everything we need from DTLReconGraph
+        edge_species_tree, edge_gene_tree, dtl_recon_graph, mpr_count, best_roots = DTLReconGraph.reconcile(filename,
+                                                                                                            D, T, L)
 
-    species_tree, species_tree_root, species_node_count = Diameter.reformat_tree(edge_species_tree, "hTop")
+        # The gene tree needs to be in node format, not edge format, so we find that now.
+        # (This also puts the gene_tree into postorder, as an ordered dict)
+        gene_tree, gene_tree_root, gene_node_count = Diameter.reformat_tree(edge_gene_tree, "pTop")
 
-    # And record the amount of time DTLReconGraph + cleaning up the graph took
-    DTLReconGraph_time_taken = time.clock() - start_time
+        species_tree, species_tree_root, species_node_count = Diameter.reformat_tree(edge_species_tree, "hTop")
+    DTLReconGraph_time_taken = DTLReconGraph_time_taken()
 
     if verbose:
         print "Reconciliation Graph Made in \033[33m\033[1m{0} seconds\033[0m".format(DTLReconGraph_time_taken)
@@ -275,29 +316,31 @@ def run_single_calculation(filename, D, T, L, log=None, debug=False, verbose=Tru
     # This list will contain all of the results we want recorded, as tuples.
     results = []
 
-    start_time = time.clock()
-
-    # Now we draw the rest of the owl
-    diameter = Diameter.diameter_algorithm(species_tree, gene_tree, gene_tree_root, dtl_recon_graph, dtl_recon_graph,
-                                           debug, False)
-
-    # And record how long it took to compute the diameter.
-    diameter_time_taken = time.clock() - start_time
-    results += [("Diameter", diameter, diameter_time_taken)]
+    # Record how long it takes to compute the diameter.
+    with timed() as diameter_time_taken:
+        # Now we draw the rest of the owl
+        diameter = Diameter.diameter_algorithm(species_tree, gene_tree, gene_tree_root, dtl_recon_graph,
+                                               dtl_recon_graph, debug, False)
+    results += [("Diameter", diameter, diameter_time_taken())]
 
     # Each one of these if statements is controlled by one option on the command line. The results from each test are
     # stored as tuples in the results list, which is passed to the write_to_csv function.
     if zero_loss:
-        start_time = time.clock()
-        zl_diameter = Diameter.diameter_algorithm(species_tree, gene_tree, gene_tree_root, dtl_recon_graph,
-                                                  dtl_recon_graph, debug, True)
-        zl_diameter_time_taken = time.clock() - start_time
-        results += [("Zero Loss Diameter", zl_diameter, zl_diameter_time_taken)]
+        with timed() as zl_diameter_time_taken:
+            zl_diameter = Diameter.diameter_algorithm(species_tree, gene_tree, gene_tree_root, dtl_recon_graph,
+                                                      dtl_recon_graph, debug, True)
+        results += [("Zero Loss Diameter", zl_diameter, zl_diameter_time_taken())]
+
+    # The median and the median cluster both need the mapping nodes of the graph in postorder, so we only sort them once
+    postorder_mapping_node_list = None
+    if median or worst_median or median_diameter or save_median_graph or median_cluster > 0:
+        postorder_mapping_node_list = DTLMedian.mapping_node_sort(gene_tree, species_tree, dtl_recon_graph.keys())
 
     median_reconciliation = {}
     if median or worst_median or median_diameter or save_median_graph:
         new_result, median_reconciliation = find_median_and_count(gene_tree, gene_tree_root, species_tree,
-                                                                  dtl_recon_graph, best_roots)
+                                                                  dtl_recon_graph, best_roots,
+                                                                  postorder_mapping_node_list)
         results += new_result
 
     if save_median_graph:
@@ -319,27 +362,43 @@ def run_single_calculation(filename, D, T, L, log=None, debug=False, verbose=Tru
     if median_cluster > 0:
         costs = "D: {0} T: {1} L: {2}".format(D, T, L)
         results += find_median_cluster(filename, log, costs, gene_tree, gene_tree_root, species_tree, dtl_recon_graph,
-                                       best_roots, median_cluster)
+                                       best_roots, median_cluster, postorder_mapping_node_list)
 
     if verbose:
         print "Results:"
         for result in results:
             print "\t{0}:\t\033[33m\033[1m{1}\033[0m".format(result[0], result[1])
 
+    costs = "D: {0} T: {1} L: {2}".format(D, T, L)
+    row = (costs, filename, mpr_count, gene_node_count, species_node_count, DTLReconGraph_time_taken, results)
+
     # Now, we write our results to a csv file.
-    if log is not None:
-        costs = "D: {0} T: {1} L: {2}".format(D, T, L)
-        write_to_csv(log + ".csv", costs, filename, mpr_count, gene_node_count, species_node_count,
-                     DTLReconGraph_time_taken,
-                     results)
+    if csv_writer is not None:
+        write_csv_row(csv_writer, write_header, *row)
+    elif log is not None and write_log:
+        write_to_csv(log + ".csv", *row)
 
     # And we're done.
-    return
+    return row
+
+
+def run_calculation_worker(args):
+    """Runs run_single_calculation in a worker process of run_iterative_calculations. The results are returned rather
+    than logged, so that only the parent process ever writes to the log.
+    :param args:    A tuple of the positional arguments to run_single_calculation, starting with the filename
+    :return:        0: The filename,
+                    1: The row of results returned by run_single_calculation (or None if it failed), and
+                    2: The traceback of the failure as a string (or None if it succeeded)"""
+    filename = args[0]
+    try:
+        return filename, run_single_calculation(*args, write_log=False), None
+    except Exception:
+        return filename, None, traceback.format_exc()
 
 
 def run_iterative_calculations(file_pattern, start, end, d, t, l, log=None, debug=False, verbose=True, loud=False,
                                zero_loss=False, median_count=False, worst_median=False, cluster=0,
-                               median_diameter=False, save_graph=False, save_median_graph=False):
+                               median_diameter=False, save_graph=False, save_median_graph=False, jobs=1):
     """Iterates over a lot of input files and finds the diameter of all of them.
     :param file_pattern: A string contains the name of the files to be used, with the counting number replaced with #'s
     :param start:       Numbered file to start on
@@ -349,6 +408,8 @@ def run_iterative_calculations(file_pattern, start, end, d, t, l, log=None, debu
     :param l:           Loss event cost
     :param log:         csv file to log results to
     :param debug:       Whether to print out every DP table made (not recommended)
+    :param jobs:        The number of files to calculate at once, each in its own process. When this is more than 1,
+                         results are logged in the order they finish rather than in file order.
     :return:
     """
     match = re.match("([^#]*)(#+)([^#]*)", file_pattern)
@@ -360,31 +421,107 @@ def run_iterative_calculations(file_pattern, start, end, d, t, l, log=None, debu
     if fill < len(str(end - 1)) or fill < len(str(start)):
         print "Starting or ending number is larger than '{1}' supports ({0})!".format((10 ** fill) - 1, file_pattern)
         return
-    print "Running {4} sequential jobs on files '{3}' with costs D = {0}, T = {1}, and L = {2}".format(d, t, l,
-                                                                                                       file_pattern,
-                                                                                                       end - start)
+    if jobs > 1:
+        mode = "parallel jobs ({0} at a time)".format(jobs)
+    else:
+        mode = "sequential jobs"
+    print "Running {4} {5} on files '{3}' with costs D = {0}, T = {1}, and L = {2}".format(d, t, l, file_pattern,
+                                                                                          end - start, mode)
+    files = []
     for i in range(start, end):
         cur_file = "{0}{1}{2}".format(match.group(1), str(i).zfill(fill), match.group(3))
         if not os.path.exists(cur_file):
             print "(file '{0}' does not exist)".format(cur_file)
             continue
-
-        print "Reconciling {0}".format(cur_file)
-
-        try:
-            run_single_calculation(cur_file, d, t, l, log, debug, verbose, zero_loss, median_count, worst_median,
-                                   cluster, median_diameter, save_graph, save_median_graph)
-        except (KeyboardInterrupt, SystemExit):
-            print "\13Thank you for playing Wing Commander!"
-            sys.exit()
-
-        except:
-            if loud:
-                print "\07"
-            if verbose:
-                print traceback.print_exc(sys.exc_traceback)
-            print "Could not reconcile file '{0}'. Continuing, but please make sure the file was formatted correctly!" \
-                .format(cur_file)
+        files += [cur_file]
+
+    # We keep the log open for the whole run, rather than reopening it for every file. The header is written along
+    # with the first row, if the log is new (or was left empty).
+    log_file = None
+    log_writer = None
+    write_header = False
+    log_created = False
+    if log is not None:
+        log_created = not os.path.isfile(log + ".csv")
+        write_header = log_created or os.path.getsize(log + ".csv") == 0
+        log_file = open(log + ".csv", 'a')
+        log_writer = csv.writer(log_file)
+
+    try:
+        if jobs > 1:
+            run_parallel_calculations(files, d, t, l, log, debug, verbose, loud, zero_loss, median_count,
+                                      worst_median, cluster, median_diameter, save_graph, save_median_graph, jobs,
+                                      log_file, log_writer, write_header)
+            return
+
+        for cur_file in files:
+
+            print "Reconciling {0}".format(cur_file)
+
+            try:
+                run_single_calculation(cur_file, d, t, l, log, debug, verbose, zero_loss, median_count, worst_median,
+                                       cluster, median_diameter, save_graph, save_median_graph,
+                                       csv_writer=log_writer, write_header=write_header)
+                write_header = False
+                if log_file is not None:
+                    log_file.flush()
+            except (KeyboardInterrupt, SystemExit):
+                print "\13Thank you for playing Wing Commander!"
+                sys.exit()
+
+            except:
+                if loud:
+                    print "\07"
+                if verbose:
+                    traceback.print_exc()
+                print "Could not reconcile file '{0}'. Continuing, but please make sure the file was formatted " \
+                      "correctly!".format(cur_file)
+    finally:
+        if log_file is not None:
+            log_file.close()
+            # If no file could be calculated, don't leave behind the empty log we made
+            if log_created and os.path.getsize(log + ".csv") == 0:
+                os.remove(log + ".csv")
+
+
+def run_parallel_calculations(files, d, t, l, log, debug, verbose, loud, zero_loss, median_count, worst_median,
+                              cluster, median_diameter, save_graph, save_median_graph, jobs, log_file=None,
+                              log_writer=None, write_header=False):
+    """Finds the diameter of every file in a list, calculating several files at once in a pool of worker processes.
+    Each file is independent of the others, so the workers share nothing, and only this process writes to the log.
+    :param files:       The list of files to calculate
+    :param jobs:        The number of worker processes to use
+    :param log_file:    The open log file (or None if there is no log)
+    :param log_writer:  A csv writer for log_file
+    :param write_header: Whether the header row still needs to be written to the log
+    The rest of the parameters are the same as for run_iterative_calculations.
+    """
+    job_args = [(cur_file, d, t, l, log, debug, verbose, zero_loss, median_count, worst_median, cluster,
+                 median_diameter, save_graph, save_median_graph) for cur_file in files]
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for cur_file, row, error in pool.imap_unordered(run_calculation_worker, job_args, chunksize=4):
+            if row is not None:
+                print "Reconciled {0}".format(cur_file)
+                if log_writer is not None:
+                    write_csv_row(log_writer, write_header, *row)
+                    write_header = False
+                    log_file.flush()
+            else:
+                if loud:
+                    print "\07"
+                if verbose:
+                    print error
+                print "Could not reconcile file '{0}'. Continuing, but please make sure the file was formatted " \
+                      "correctly!".format(cur_file)
+    except (KeyboardInterrupt, SystemExit):
+        pool.terminate()
+        pool.join()
+        print "\13Thank you for playing Wing Commander!"
+        sys.exit()
+    pool.close()
+    pool.join()
 
 
 def main():
@@ -418,6 +555,8 @@ def main():
                  help="save the median DTL reconciliation graph to an SIF file after it has been made.")
     p.add_option("-c", "--cluster", dest="cluster", action="store", default=0,
                  help="find the distances to the furthest mpr of the specified number of random single medians (requires logging)")
+    p.add_option("-j", "--jobs", dest="jobs", action="store", default=1, type=int,
+                 help="calculate this many files at once when using the iterate flag, each in its own process")
 
     (options, args) = p.parse_args()
     if len(args) != 4:
@@ -436,12 +575,15 @@ def main():
     median_diameter = options.median_diameter
     save_graph = options.save_graph
     save_median_graph = options.save_median_graph
+    jobs = options.jobs
 
     # Medians must be calculated if we use worst_median, so just add this in.
     median_count = options.median_count or worst_median
 
     if cluster > 0 and not log:
         p.error("you must specify a log file when doing cluster tests!")
+    if jobs < 1:
+        p.error("the number of jobs must be at least 1!")
     if cluster:
         cluster_log_folder = os.path.splitext(log)[0]
         if not os.path.exists(cluster_log_folder):
@@ -454,7 +596,8 @@ def main():
     elif options.count is not None:
         rep = options.count
         run_iterative_calculations(filename, rep[0], rep[1], d, t, l, log, debug, verbose, loud, zero_loss,
-                                   median_count, worst_median, cluster, median_diameter, save_graph, save_median_graph)
+                                   median_count, worst_median, cluster, median_diameter, save_graph, save_median_graph,
+                                   jobs)
     else:
         run_single_calculation(filename, d, t, l, log, debug, verbose, zero_loss, median_count, worst_median,
                                cluster, median_diameter, save_graph, save_median_graph)